@@ -0,0 +1,799 @@
+'''
+Benchmarks
+
+    python benchmarks.py models [--tiers trf lg md sm] [--limit N] [--out FILE]
+    python benchmarks.py fuzzy [--repeat N]
+    python benchmarks.py stages [--scales 1 4] [--repeat N] [--skip-ner] [--out FILE] [--baseline FILE]
+    python benchmarks.py service [--clients 8] [--seconds 10] [--cache-sizes 0 4096] [--url URL] [--out FILE]
+
+models: runs people / crew / comic extraction with each NER model tier and
+scores the output against the curated tables (table_store, seeded from
+tables/all_episodes.xlsx and tables/public_feed_comics.xlsx), alongside wall time and peak memory. Each
+tier runs in its own process so memory figures don't leak between tiers.
+
+fuzzy: times get_comics.match_segments against the pairwise nltk loops it
+replaced, on the timestamps and bulleted lists of every stored episode.
+Timestamp labels and bullets stand in for WORK_OF_ART entities, so no model
+is needed.
+
+stages: times each pipeline stage on its own (JSON load, episode store,
+initial_parse, HTML parsing, NER, get_people, get_crew, get_timestamps,
+get_bullets, match_segments and table I/O) over the checked-in
+public_feed.json and synthetic copies of it scaled up N times. Results are
+saved as JSON with --out; with --baseline, each stage is compared to a saved
+run and slowdowns beyond --tolerance are reported as regressions (exit code 1).
+
+service: load test of the query service (service.py) on localhost. The
+service is started in its own process once per LRU cache size, and
+--clients keep-alive clients request a random mix of episode, person, crew,
+comic and date range queries over the real tables for --seconds. Reports
+throughput and p50 / p90 / p99 latency.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# custom scripts
+import table_store
+
+
+#### scoring against the curated tables
+def get_pairs(df, col, ids, split=table_store.split_names):
+    # (show_id, item) for every item in col, for episodes in ids
+    pairs = set()
+
+    for show_id, value in zip(df['show_id'].astype(str), df[col]):
+        if show_id in ids:
+            for item in split(value):
+                pairs.add((show_id, item))
+
+    return pairs
+
+
+def score(found, expected):
+    # micro precision / recall over (show_id, item) pairs
+    correct = len(found & expected)
+
+    precision = correct / len(found) if found else 0.0
+    recall = correct / len(expected) if expected else 0.0
+
+    return {'precision': round(precision, 4), 'recall': round(recall, 4)}
+
+
+def run_tier(tier, limit=None):
+    '''
+    Extract people, crew and comics with one model tier
+
+    Output: dict of timings, peak memory and scores
+    '''
+
+    import resource
+    import pandas as pd
+
+    import episode_store
+    import get_comics
+    import get_episodes
+    import ner
+
+    ner.set_tier(tier)
+    ner.use_cache = False # time the model, not the cache
+
+    rss = episode_store.load()
+
+    if limit:
+        rss = dict(list(rss.items())[:limit])
+
+    curated_episodes = table_store.read_episodes()
+    curated_comics = table_store.read_comics()
+
+    start = time.perf_counter()
+    ner.get_nlp()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    episodes = get_episodes.initial_parse(rss)
+
+    # a scratch regulars registry, so scoring never counts into the real one
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'ircb.db')
+
+        # empty file, so it does not seed itself from the curated tables
+        open(db, 'w').close()
+
+        full = get_episodes.get_regulars(episodes, path=db)
+
+    found = get_episodes.extract(episodes, full)
+    episode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = get_comics.parse_episodes(rss, found)
+    comics = pd.DataFrame(rows, columns=curated_comics.columns)
+    comic_time = time.perf_counter() - start
+
+    # only score episodes that have been curated
+    ids = set(found['show_id'].astype(str)) & set(curated_episodes['show_id'].astype(str))
+
+    result = {'tier': tier,
+              'model': ner.model_name,
+              'episodes': len(ids),
+              'load_seconds': round(load_time, 2),
+              'episode_seconds': round(episode_time, 2),
+              'comic_seconds': round(comic_time, 2),
+              'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+    for col in ['people', 'producer', 'editor', 'prooflistener']:
+        result[col] = score(get_pairs(found, col, ids),
+                            get_pairs(curated_episodes, col, ids))
+
+    # comic titles, ignoring case
+    split = lambda value: {value.strip().lower()} if isinstance(value, str) else set()
+
+    result['comic'] = score(get_pairs(comics, 'comic', ids, split),
+                            get_pairs(curated_comics, 'comic', ids, split))
+
+    return result
+
+
+def models(tiers, limit=None, out=None):
+    results = list()
+
+    for tier in tiers:
+        print(f'Benchmarking {tier}...')
+
+        cmd = [sys.executable, __file__, 'tier', tier]
+
+        if limit:
+            cmd += ['--limit', str(limit)]
+
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+
+        if proc.returncode != 0:
+            print(proc.stderr)
+            continue
+
+        # result is the last line printed
+        results.append(json.loads(proc.stdout.strip().split('\n')[-1]))
+
+    print()
+    print(f'{"tier":<5}{"time (s)":>10}{"mem (MB)":>10}  ' +
+          '  '.join(f'{col + " P/R":>19}' for col in ['people', 'producer', 'editor', 'prooflistener', 'comic']))
+
+    for result in results:
+        seconds = result['load_seconds'] + result['episode_seconds'] + result['comic_seconds']
+
+        print(f'{result["tier"]:<5}{seconds:>10.1f}{result["peak_rss_mb"]:>10.0f}  ' +
+              '  '.join(f'{result[col]["precision"]:>13.3f}/{result[col]["recall"]:.3f}'
+                        for col in ['people', 'producer', 'editor', 'prooflistener', 'comic']))
+
+    if out:
+        with open(out, 'w') as fp:
+            fp.write(json.dumps(results, indent=2))
+
+    return results
+
+
+#### match_segments microbenchmark
+def match_segments_loops(comics, art, timestamps, base_url):
+    # match_segments before fuzzy.py: nltk Jaro-Winkler, one pair at a time
+    from nltk.metrics.distance import jaro_winkler_similarity
+
+    import get_comics
+    from records import Timestamp
+
+    timestamp_keys = dict((seg.lower(), seg) for seg in timestamps.keys())
+
+    matched = dict()
+    for comic, segment in comics.items():
+        seg = segment.lower()
+
+        max_sim = 0
+        assign = None
+
+        for key in timestamp_keys:
+            sim = jaro_winkler_similarity(seg, key)
+
+            if sim > max_sim:
+                assign = timestamp_keys[key]
+                max_sim = sim
+
+        if assign is not None:
+            matched[comic] = assign
+
+    all_comics = dict()
+    skip = set()
+
+    for comic, segment in matched.items():
+        stamp = timestamps[segment].timestamp
+        url = timestamps[segment].direct_url
+
+        if jaro_winkler_similarity(comic, segment) > .85:
+            skip.add(segment)
+            segment = 'Timestamps'
+
+        all_comics[comic] = Timestamp(segment, stamp, url)
+
+    non = get_comics.get_non_comic_tags()
+
+    for label, info in timestamps.items():
+        if label not in skip and not non.search(label):
+            all_comics[label] = info
+
+    if art:
+        compare = list(all_comics.keys())
+
+        for item in art:
+            found = False
+
+            for alt in compare:
+                if jaro_winkler_similarity(item.lower(), alt.lower()) > .8:
+                    found = True
+
+            if not found and not non.search(item):
+                all_comics[item] = Timestamp('Other', '00:00:00', base_url)
+
+    return all_comics
+
+
+def fuzzy(repeat=3):
+    import episode_store
+    import get_comics
+
+    rss = episode_store.load()
+
+    inputs = list()
+
+    for details in rss.values():
+        url = details['links'][0]['href']
+        # same choice as get_comics.parse_episodes, summary-only entries included
+        timestamps, comics = get_comics.extract_html(get_comics.get_summary_raw(details), url)
+
+        # stand-in for WORK_OF_ART entities
+        art = list(comics.keys()) + list(timestamps.keys())
+
+        inputs.append((comics, art, timestamps, url))
+
+    pairs = sum(len(comics) * len(timestamps) + len(art) * (len(comics) + len(timestamps))
+                for comics, art, timestamps, url in inputs)
+
+    print(f'{len(inputs)} episodes, about {pairs} string pairs per pass')
+
+    results = dict()
+
+    for name, func in [('loops', match_segments_loops), ('batched', get_comics.match_segments)]:
+        times = list()
+
+        for i in range(repeat):
+            start = time.perf_counter()
+            output = [func(*args) for args in inputs]
+            times.append(time.perf_counter() - start)
+
+        results[name] = {'seconds': round(min(times), 4), 'output': output}
+
+        print(f'{name:<8} {min(times):.3f}s')
+
+    same = results['loops']['output'] == results['batched']['output']
+
+    print(f'speedup {results["loops"]["seconds"] / results["batched"]["seconds"]:.1f}x, same output: {same}')
+
+    return results
+
+
+#### per-stage benchmarks
+def scale_feed(rss, scale):
+    '''
+    Synthetic feed, scale times the size of rss
+
+    Copies get their own id / show_id, and their descriptions differ by
+    trailing whitespace so nothing is served from a parse cache.
+    '''
+
+    scaled = dict()
+
+    for k in range(scale):
+        for show_id, entry in rss.items():
+            if k == 0:
+                scaled[show_id] = entry
+                continue
+
+            copy = json.loads(json.dumps(entry))
+            copy['id'] = f'{entry["id"]}-{k}'
+            copy['summary'] = copy['summary'] + ' ' * k
+
+            for content in copy.get('content', []):
+                content['value'] = content['value'] + ' ' * k
+
+            scaled[f'{show_id}-{k}'] = copy
+
+    return scaled
+
+
+def time_stage(func, repeat):
+    # best of repeat runs, with the last result
+    times = list()
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def get_environment():
+    from importlib import metadata
+
+    versions = dict()
+
+    for package in ['pandas', 'beautifulsoup4', 'rapidfuzz', 'openpyxl', 'spacy']:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'commit': commit,
+            'packages': versions}
+
+
+def run_stages(scale, repeat=3, ner_stages=True):
+    '''
+    Time every stage over public_feed.json, scaled up scale times
+
+    Output: dict of {stage: {'seconds', 'items'}} for this scale
+    '''
+
+    import episode_html
+    import episode_store
+    import get_comics
+    import get_episodes
+    import ner
+    from records import ComicMention, to_frame
+
+    with open(episode_store.legacy_file, 'r') as fp:
+        legacy = json.loads(fp.read())
+
+    # same {show_id: entry} as the episode store, newest first
+    rss = dict((episode_store.get_show_id(entry), entry)
+               for i, entry in sorted(legacy.items(), key=lambda item: int(item[0])))
+    rss = scale_feed(rss, scale)
+    n = len(rss)
+
+    stages = dict()
+
+    def record(name, func, items=n, times=repeat):
+        seconds, result = time_stage(func, times)
+        stages[name] = {'seconds': round(seconds, 5), 'items': items}
+        print(f'  {name:<16}{seconds:>10.4f}s')
+
+        return result
+
+    print(f'scale {scale}: {n} episodes')
+
+    #### feed
+    text = json.dumps(rss)
+    record('json_load', lambda: json.loads(text))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'feed.db')
+        db = os.path.join(tmp, 'ircb.db')
+
+        # empty files, so neither store seeds itself from the real data
+        for path in [store, db]:
+            open(path, 'w').close()
+
+        record('store_write', lambda: episode_store.upsert(list(rss.values()), path=store), times=1)
+        record('store_load', lambda: episode_store.load(path=store))
+
+        #### episodes
+        # includes parsing the HTML, as on a first run
+        def initial_parse():
+            episode_html.parse_summary.cache_clear()
+            return get_episodes.initial_parse(rss)
+
+        parsed = record('initial_parse', initial_parse)
+
+        summaries = list()
+        urls = list()
+
+        for details in rss.values():
+            # same choice as get_comics.parse_episodes
+            summaries.append(get_comics.get_summary_raw(details))
+            urls.append(details['links'][0]['href'])
+
+        def parse_all():
+            episode_html.parse_summary.cache_clear()
+            return [episode_html.parse_summary(summary) for summary in summaries]
+
+        # the comic stages below work on these, not on the cache
+        parsed_html = record('html_parse', parse_all)
+
+        episodes = parsed.copy()
+
+        for col in ['people', 'producer', 'prooflistener', 'editor']:
+            episodes[col] = ''
+
+        if ner_stages:
+            try:
+                ner.use_cache = False # time the model, not the cache
+                record('ner_load', ner.get_nlp, times=1)
+
+                docs = record('ner', lambda: ner.pipe_docs(parsed['full_summary'],
+                                                           disable=get_episodes.ner_disable), times=1)
+
+                # registry in the temporary table store, not the real one
+                full = get_episodes.get_regulars(parsed, path=db, store=store)
+                episodes['people'] = record('get_people', lambda: [get_episodes.get_people(doc, full) for doc in docs])
+
+                extractor = get_episodes.Extractor(full)
+                record('get_crew', lambda: [extractor.get_crew(doc) for doc in docs])
+
+            except (ImportError, OSError) as e:
+                print(f'  NER stages skipped: {e}')
+
+        #### comics
+        # failures count as nothing found, as in get_comics.extract_html
+        def each(func, *iterables):
+            out = list()
+
+            for args in zip(*iterables):
+                try:
+                    out.append(func(*args))
+                except:
+                    out.append(dict())
+
+            return out
+
+        timestamps = record('get_timestamps', lambda: each(get_comics.get_timestamps, parsed_html, urls))
+        bullets = record('get_bullets', lambda: each(get_comics.get_bullets, parsed_html))
+
+        # timestamp labels and bullets stand in for WORK_OF_ART entities
+        art = [list(comics) + list(stamps) for comics, stamps in zip(bullets, timestamps)]
+
+        merged = record('match_segments', lambda: [get_comics.match_segments(*args) for args in
+                                                   zip(bullets, art, timestamps, urls)])
+
+        rows = list()
+
+        for title, show_id, all_comics in zip(parsed['title'], parsed['show_id'], merged):
+            for comic, stamp in all_comics.items():
+                rows.append(ComicMention(title, show_id, comic, *stamp))
+
+        comics = to_frame(rows, ComicMention)
+        episodes = episodes[table_store.episode_columns]
+
+        #### tables
+        record('table_upsert', lambda: table_store.upsert(episodes=episodes, comics=comics, path=db),
+               items=n + len(comics))
+        tables = record('table_read', lambda: (table_store.read_episodes(path=db), table_store.read_comics(path=db)),
+                        items=n + len(comics))
+
+        def export():
+            tables[0].to_excel(os.path.join(tmp, 'episodes.xlsx'), index=False)
+            tables[1].to_excel(os.path.join(tmp, 'comics.xlsx'), index=False)
+
+        record('table_export', export, items=n + len(comics), times=1)
+
+    return {'scale': scale, 'episodes': n, 'comics': len(comics), 'stages': stages}
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.005):
+    '''
+    Stages that got slower than the baseline run
+
+    A stage regresses if it is more than tolerance (fraction) slower and at
+    least min_seconds slower, so tiny stages don't flag on timer noise.
+
+    Output: list of (scale, stage, baseline seconds, seconds)
+    '''
+
+    old = dict((run['scale'], run['stages']) for run in baseline['results'])
+    regressions = list()
+
+    print()
+    print(f'{"scale":<7}{"stage":<17}{"baseline":>10}{"now":>10}{"change":>9}')
+
+    for run in results['results']:
+        for stage, info in run['stages'].items():
+            if stage not in old.get(run['scale'], {}):
+                continue
+
+            before = old[run['scale']][stage]['seconds']
+            now = info['seconds']
+            change = (now - before) / before if before > 0 else 0.0
+
+            flag = ''
+
+            if now > before * (1 + tolerance) and now - before >= min_seconds:
+                regressions.append((run['scale'], stage, before, now))
+                flag = '  REGRESSION'
+
+            print(f'{run["scale"]:<7}{stage:<17}{before:>10.4f}{now:>10.4f}{change:>+9.0%}{flag}')
+
+    print()
+    print(f'{len(regressions)} regressions (tolerance {tolerance:.0%})')
+
+    return regressions
+
+
+def stages(scales=(1,), repeat=3, ner_stages=True, out=None, baseline=None, tolerance=0.25):
+    results = {'environment': get_environment(),
+               'repeat': repeat,
+               'results': [run_stages(scale, repeat, ner_stages) for scale in scales]}
+
+    if out:
+        with open(out, 'w') as fp:
+            fp.write(json.dumps(results, indent=2))
+
+        print(f'Saved to {out}')
+
+    regressions = list()
+
+    if baseline:
+        with open(baseline, 'r') as fp:
+            regressions = compare(results, json.loads(fp.read()), tolerance)
+
+    return results, regressions
+
+
+#### load test of the query service
+def service_targets(n=2000, seed=0):
+    # a mix of request targets over the real tables: episode lookups, people, crew, comics, date ranges
+    import random
+    from urllib.parse import quote, urlencode
+
+    import service
+
+    tables = service.Tables()
+    rng = random.Random(seed)
+
+    show_ids = list(tables.by_show_id)
+    people = list(tables.by_person)
+    crew = [(role, name) for role, names in tables.by_role.items() for name in names]
+    comics = [str(comic['comic']) for comic in tables.comics if comic['comic'] is not None]
+    dates = tables.dates
+
+    targets = list()
+
+    for i in range(n):
+        kind = rng.random()
+
+        if kind < 0.35:
+            target = '/episodes/' + quote(rng.choice(show_ids))
+        elif kind < 0.55:
+            target = '/episodes?' + urlencode({'person': rng.choice(people)})
+        elif kind < 0.7:
+            role, name = rng.choice(crew)
+            target = '/episodes?' + urlencode({role: name})
+        elif kind < 0.85:
+            target = '/comics?' + urlencode({'title': rng.choice(comics)})
+        else:
+            start, end = sorted(rng.sample(dates, 2))
+            target = '/episodes?' + urlencode({'from': start, 'to': end, 'limit': 20})
+
+        targets.append(target)
+
+    return targets
+
+
+def load_test(url, targets, clients=8, seconds=10, seed=0):
+    '''
+    Hit a running query service with concurrent keep-alive clients
+
+    Each client thread requests random targets back to back for the given
+    time.
+
+    Output: dict of requests, errors, throughput (requests / s) and latency
+    percentiles (ms)
+    '''
+
+    import http.client
+    import random
+    import threading
+    from urllib.parse import urlsplit
+
+    address = urlsplit(url)
+    latencies = list()
+    errors = list()
+    deadline = time.perf_counter() + seconds
+
+    def client(i):
+        rng = random.Random(seed + i)
+        conn = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+        mine = list()
+
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+
+            try:
+                conn.request('GET', rng.choice(targets))
+                response = conn.getresponse()
+                response.read()
+
+                if response.status >= 500:
+                    errors.append(response.status)
+
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(repr(e))
+                conn.close()
+                conn = http.client.HTTPConnection(address.hostname, address.port, timeout=30)
+                continue
+
+            mine.append(time.perf_counter() - start)
+
+        conn.close()
+        latencies.extend(mine)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(q):
+        return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+
+    return {'clients': clients,
+            'seconds': round(elapsed, 2),
+            'requests': len(latencies),
+            'errors': len(errors),
+            'throughput': round(len(latencies) / elapsed, 1),
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'max_ms': percentile(1.0)}
+
+
+def start_service(cache_size):
+    # query service in its own process on a free port, so clients don't share its GIL
+    import socket
+    import urllib.request
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    process = subprocess.Popen([sys.executable, cli, 'serve', '--port', str(port), '--cache-size', str(cache_size)],
+                               stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+
+    for i in range(600):
+        try:
+            urllib.request.urlopen(url + '/status').read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError('query service did not start')
+
+
+def service_status(url):
+    import urllib.request
+
+    return json.loads(urllib.request.urlopen(url + '/status').read())
+
+
+def service(clients=8, seconds=10, cache_sizes=(0, 4096), url=None, out=None):
+    '''
+    p99 latency and throughput of the query service on localhost
+
+    Starts the service once per cache size (0 is no cache), unless url
+    points at one that is already running.
+    '''
+
+    targets = service_targets()
+    print(f'{len(targets)} targets, {len(set(targets))} distinct')
+
+    results = {'environment': get_environment(), 'results': list()}
+    runs = [(None, url)] if url else [(size, None) for size in cache_sizes]
+
+    for cache_size, run_url in runs:
+        process = None
+
+        if run_url is None:
+            process, run_url = start_service(cache_size)
+
+        try:
+            result = load_test(run_url, targets, clients, seconds)
+            result['cache_size'] = cache_size
+            result['cache'] = service_status(run_url)['cache']
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+        results['results'].append(result)
+
+        print(f'cache {cache_size}: {result["requests"]} requests in {result["seconds"]}s, '
+              f'{result["throughput"]} req/s, p50 {result["p50_ms"]} ms, p90 {result["p90_ms"]} ms, '
+              f'p99 {result["p99_ms"]} ms, {result["errors"]} errors, cache hits {result["cache"]["hits"]}')
+
+    if out:
+        with open(out, 'w') as fp:
+            fp.write(json.dumps(results, indent=2))
+
+        print(f'Saved to {out}')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IRCB benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('models', help='accuracy vs speed of each NER model tier')
+    cmd.add_argument('--tiers', nargs='+', default=['trf', 'lg', 'md', 'sm'],
+                     choices=['trf', 'lg', 'md', 'sm'])
+    cmd.add_argument('--limit', type=int, help='only the newest N episodes')
+    cmd.add_argument('--out', help='save results as JSON')
+
+    cmd = commands.add_parser('fuzzy', help='match_segments vs pairwise nltk loops')
+    cmd.add_argument('--repeat', type=int, default=3)
+
+    cmd = commands.add_parser('stages', help='time each pipeline stage, optionally against a baseline')
+    cmd.add_argument('--scales', nargs='+', type=int, default=[1, 4],
+                     help='sizes of the synthetic feeds, in copies of public_feed.json')
+    cmd.add_argument('--repeat', type=int, default=3)
+    cmd.add_argument('--skip-ner', action='store_true', help='skip model load, NER, get_people and get_crew')
+    cmd.add_argument('--out', help='save results as JSON')
+    cmd.add_argument('--baseline', help='JSON from an earlier run to compare against')
+    cmd.add_argument('--tolerance', type=float, default=0.25, help='slowdown (fraction) that counts as a regression')
+
+    cmd = commands.add_parser('service', help='load test of the local query service')
+    cmd.add_argument('--clients', type=int, default=8, help='concurrent keep-alive clients')
+    cmd.add_argument('--seconds', type=float, default=10, help='duration of each run')
+    cmd.add_argument('--cache-sizes', nargs='+', type=int, default=[0, 4096],
+                     help='start the service once per LRU cache size (0 is no cache)')
+    cmd.add_argument('--url', help='test a service that is already running instead')
+    cmd.add_argument('--out', help='save results as JSON')
+
+    # one tier, run in a child process by models
+    cmd = commands.add_parser('tier')
+    cmd.add_argument('tier')
+    cmd.add_argument('--limit', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'models':
+        models(args.tiers, args.limit, args.out)
+
+    elif args.command == 'fuzzy':
+        fuzzy(args.repeat)
+
+    elif args.command == 'stages':
+        results, regressions = stages(args.scales, args.repeat, not args.skip_ner,
+                                      args.out, args.baseline, args.tolerance)
+
+        if regressions:
+            sys.exit(1)
+
+    elif args.command == 'service':
+        service(args.clients, args.seconds, args.cache_sizes, args.url, args.out)
+
+    elif args.command == 'tier':
+        print(json.dumps(run_tier(args.tier, args.limit)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+'''
+Command line entry point for the whole pipeline
+
+    python cli.py sync             download new / changed episodes
+    python cli.py parse            metadata parse of stored episodes (no NLP)
+    python cli.py extract-people   full episode table (people and crew)
+    python cli.py extract-comics   full comics table
+    python cli.py update           sync, then add new episodes to the tables
+    python cli.py stream           parse stored episodes into the tables in bounded batches
+    python cli.py watch            keep polling, update the tables when a feed changes
+    python cli.py export           write the xlsx tables from the table store
+    python cli.py search QUERY     episodes matching QUERY, with timestamp links
+    python cli.py serve            local JSON query service over the tables
+    python cli.py status           what is stored and when it was updated
+    python cli.py regulars         show regulars and manage first name overrides
+    python cli.py benchmark-models precision / recall and cost of each model tier
+
+NLP stages use the model tier given with --model (trf, lg, md, sm; default
+trf, or the IRCB_MODEL_TIER environment variable).
+
+Heavy dependencies (pandas, spacy, the NER model) are only imported by the
+stages that need them, so status and an update with no new episodes return
+without loading any of them.
+
+Every command except search, serve, status, regulars and watch writes a JSON run report (stage times, counters,
+peak memory) to --report-dir; --profile DIR also saves a cProfile dump of
+each stage. watch only saves a report for polls that added episodes or
+failed.
+
+update, stream and watch write the xlsx tables after adding episodes, as
+update_tables.py does; --no-export leaves them to a later export.
+'''
+
+import argparse
+import os
+import time
+
+# custom scripts
+import instrument
+
+
+def sync(args):
+    import episode_store
+    import get_rss
+
+    episode_store.archive = args.archive
+    get_rss.sync()
+
+
+def parse(args):
+    import episode_store
+    import get_episodes
+
+    with instrument.stage('store_load'):
+        rss = episode_store.load()
+
+    instrument.count('episodes_seen', len(rss))
+
+    with instrument.stage('initial_parse'):
+        episodes = get_episodes.initial_parse(rss)
+
+    print(f'{len(episodes)} episodes parsed, {episodes["has_timestamps"].sum()} with timestamps')
+
+    if args.out:
+        episodes.to_excel(args.out, index=False)
+        print(f'Saved to {args.out}')
+
+
+def extract_people(args):
+    import get_episodes
+
+    get_episodes.main()
+
+
+def extract_comics(args):
+    import get_comics
+
+    get_comics.pool_workers = args.workers
+    get_comics.main()
+
+
+def update(args):
+    import episode_store
+    import get_rss
+    import table_store
+
+    episode_store.archive = args.archive
+    get_rss.sync()
+
+    # stored episodes missing from the tables, including any left by an
+    # earlier update that failed after its sync. None: stop before pandas /
+    # spacy are imported
+    if len(episode_store.show_ids() - table_store.episode_ids()) == 0:
+        print('No new episodes.')
+        return
+
+    import get_comics
+    import update_tables
+
+    get_comics.pool_workers = args.workers
+    update_tables.update()
+
+    if args.export:
+        export(args)
+
+
+def stream(args):
+    import episode_store
+    import get_comics
+    import table_store
+    import update_tables
+
+    show_ids = None
+
+    if not args.all:
+        show_ids = episode_store.show_ids() - table_store.episode_ids()
+
+        if len(show_ids) == 0:
+            print('No new episodes.')
+            return
+
+    get_comics.pool_workers = args.workers
+    update_tables.stream(show_ids, args.batch_size)
+
+    if args.export:
+        export(args)
+
+
+def watch(args):
+    import episode_store
+    import get_comics
+    import watch
+
+    episode_store.archive = args.archive
+    get_comics.pool_workers = args.workers
+
+    if args.interval:
+        watch.interval = args.interval * 60
+
+    if args.max_interval:
+        watch.max_interval = args.max_interval * 60
+
+    if args.status_file:
+        watch.status_file = args.status_file
+
+    watch.main(export=args.export, port=args.port)
+
+
+def export(args):
+    import table_store
+
+    table_store.export()
+
+
+def search(args):
+    import search_index
+
+    if args.rebuild:
+        print(f'{search_index.rebuild()} episodes indexed')
+
+    start = time.perf_counter()
+    hits = search_index.search(' '.join(args.query), args.limit, args.raw)
+    ms = (time.perf_counter() - start) * 1000
+
+    for hit in hits:
+        print(f'{hit.title} ({hit.date})')
+        print(f'    {hit.snippet}')
+
+        for mention in hit.mentions:
+            print(f'    {mention.timestamp} {mention.comic}: {mention.direct_url}')
+
+    print(f'{len(hits)} episodes in {ms:.1f} ms')
+
+
+def serve(args):
+    import service
+
+    if args.cache_size is not None:
+        service.cache_size = args.cache_size
+
+    service.serve(args.port)
+
+
+def status(args):
+    import episode_store
+    import feeds
+    import table_store
+
+    print(f'{episode_store.count()} episodes in {episode_store.store_file}')
+
+    for show_id, entry in episode_store.newest().items():
+        print(f'Newest: {entry["title"]} ({entry["published"]})')
+
+    state = feeds.load_state()
+
+    for name, validators in state.items():
+        print(f'Last sync of {name}: ETag {validators.get("etag")}, Last-Modified {validators.get("modified")}')
+
+    if not state:
+        print('Last sync: never')
+
+    # only if it exists, seeding it would load pandas
+    if os.path.exists(table_store.db_file):
+        print(f'{table_store.count("episodes")} episodes and {table_store.count("comics")} comics in {table_store.db_file}')
+
+    for file in [feeds.state_file, table_store.episode_file, table_store.comic_file]:
+        if os.path.exists(file):
+            modified = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(file)))
+            print(f'{file} last written {modified}')
+
+
+def regulars(args):
+    import get_episodes
+    import table_store
+
+    if args.override:
+        table_store.set_override(*args.override)
+
+    if args.remove:
+        table_store.set_override(args.remove)
+
+    full = get_episodes.get_regulars()
+    counts = table_store.regular_counts()
+
+    for first_name, name in sorted(full.items()):
+        print(f'{first_name:<12}{name:<24}{counts.get(name, "override")}')
+
+
+def benchmark_models(args):
+    import benchmarks
+
+    benchmarks.models(args.tiers, args.limit, args.out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IRCB episode and comic tables')
+    parser.add_argument('--model', choices=['trf', 'lg', 'md', 'sm'],
+                        help='NER model tier for people, crew and comic extraction')
+    parser.add_argument('--report-dir', default=instrument.report_dir,
+                        help='where to save the JSON run report')
+    parser.add_argument('--profile', metavar='DIR', default=instrument.profile_dir,
+                        help='save a cProfile dump of each stage to DIR')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('sync', help='download new or changed episodes')
+    cmd.add_argument('--archive', action='store_true', help='also keep the raw feed entries')
+    cmd.set_defaults(func=sync)
+
+    cmd = commands.add_parser('parse', help='metadata parse of stored episodes (no NLP)')
+    cmd.add_argument('--out', help='save the parsed table to this .xlsx file')
+    cmd.set_defaults(func=parse)
+
+    commands.add_parser('extract-people', help='rebuild the episode table').set_defaults(func=extract_people)
+    cmd = commands.add_parser('extract-comics', help='rebuild the comics table')
+    cmd.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes for HTML extraction')
+    cmd.set_defaults(func=extract_comics)
+    cmd = commands.add_parser('update', help='sync and add new episodes to the tables')
+    cmd.add_argument('--no-export', dest='export', action='store_false', help='leave the xlsx tables as they are')
+    cmd.add_argument('--archive', action='store_true', help='also keep the raw feed entries')
+    cmd.add_argument('--workers', type=int, default=1, help='worker processes for HTML extraction')
+    cmd.set_defaults(func=update)
+
+    cmd = commands.add_parser('stream', help='parse stored episodes into the tables in bounded batches')
+    cmd.add_argument('--all', action='store_true', help='every stored episode, not just those missing from the tables')
+    cmd.add_argument('--batch-size', type=int, help='episodes per batch (default 64)')
+    cmd.add_argument('--no-export', dest='export', action='store_false', help='leave the xlsx tables as they are')
+    cmd.add_argument('--workers', type=int, default=1, help='worker processes for HTML extraction')
+    cmd.set_defaults(func=stream)
+
+    cmd = commands.add_parser('watch', help='keep polling the feeds, update the tables when one changes')
+    cmd.add_argument('--interval', type=float, help='minutes between polls while episodes come in (default 15)')
+    cmd.add_argument('--max-interval', type=float, help='longest wait between polls in minutes (default 360)')
+    cmd.add_argument('--no-export', dest='export', action='store_false', help='leave the xlsx tables as they are after an update')
+    cmd.add_argument('--archive', action='store_true', help='also keep the raw feed entries')
+    cmd.add_argument('--workers', type=int, default=1, help='worker processes for HTML extraction')
+    cmd.add_argument('--status-file', help='where to write the watcher status (default watch_status.json)')
+    cmd.add_argument('--port', type=int, help='also serve the status as JSON on localhost:PORT')
+    cmd.set_defaults(func=watch, report=False)
+
+    commands.add_parser('export', help='write the xlsx tables').set_defaults(func=export)
+    cmd = commands.add_parser('search', help='full-text search of episodes and comics')
+    cmd.add_argument('query', nargs='+', help='words to look for')
+    cmd.add_argument('--limit', type=int, default=10, help='most episodes to show')
+    cmd.add_argument('--raw', action='store_true', help='query is FTS5 syntax (phrases, OR, NOT, prefix*)')
+    cmd.add_argument('--rebuild', action='store_true', help='rebuild the index from the tables first')
+    cmd.set_defaults(func=search, report=False)
+
+    cmd = commands.add_parser('serve', help='local read-only JSON query service over the tables')
+    cmd.add_argument('--port', type=int, default=8080)
+    cmd.add_argument('--cache-size', type=int, help='responses kept in the LRU cache (default 4096, 0 for none)')
+    cmd.set_defaults(func=serve, report=False)
+
+    commands.add_parser('status', help='show what is stored').set_defaults(func=status, report=False)
+
+    cmd = commands.add_parser('regulars', help='show regulars, or set a first name -> full name override')
+    cmd.add_argument('--override', nargs=2, metavar=('FIRST', 'FULL'), help='always read FIRST as FULL')
+    cmd.add_argument('--remove', metavar='FIRST', help='remove the override for FIRST')
+    cmd.set_defaults(func=regulars, report=False)
+
+    cmd = commands.add_parser('benchmark-models', help='score each NER model tier against the curated tables')
+    cmd.add_argument('--tiers', nargs='+', default=['trf', 'lg', 'md', 'sm'],
+                     choices=['trf', 'lg', 'md', 'sm'])
+    cmd.add_argument('--limit', type=int, help='only the newest N episodes')
+    cmd.add_argument('--out', help='save results as JSON')
+    cmd.set_defaults(func=benchmark_models)
+
+    args = parser.parse_args()
+
+    # only sets the model name, nothing is loaded here
+    if args.model:
+        import ner
+        ner.set_tier(args.model)
+
+    instrument.report_dir = args.report_dir
+    instrument.profile_dir = args.profile
+
+    # these manage their own runs, or none
+    if not getattr(args, 'report', True):
+        args.func(args)
+        return
+
+    with instrument.run(args.command):
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+'''
+Canonical comic titles, shared across episodes
+
+Every title in the comics table is indexed once, by its normalized form
+(lowercase, punctuation and extra spaces removed) and by the character
+trigrams of that form. A new title is looked up by:
+
+  1. the alias table (nicknames and interview segment labels, from
+     comic_aliases.json)
+  2. an exact match on the normalized form
+  3. trigram postings: only titles sharing a trigram with the new one are
+     scored (Dice similarity), never the whole list of known titles
+
+The index lives next to the tables in table_store.db_file. It is built from
+the comics table (seeded from tables/public_feed_comics.xlsx) on first use,
+and new titles are added as episodes are added to the tables.
+'''
+
+import json
+import re
+
+# custom scripts
+import table_store
+
+### global variables ###
+aliases_file = 'comic_aliases.json'
+_aliases = None
+# alias -> title maps, see load_aliases
+
+min_similarity = 0.9
+# Dice similarity of trigram sets needed to treat two titles as the same
+max_candidates = 20
+# titles sharing the most trigrams that are scored in full
+
+schema = [
+    '''CREATE TABLE IF NOT EXISTS comic_titles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            norm TEXT UNIQUE,
+            grams INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS comic_grams (
+            gram TEXT,
+            title_id INTEGER)''',
+    '''CREATE INDEX IF NOT EXISTS comic_grams_gram ON comic_grams (gram)''',
+    '''CREATE TABLE IF NOT EXISTS comic_aliases (
+            alias TEXT PRIMARY KEY,
+            title TEXT)''',
+]
+
+
+def load_aliases(path=None):
+    '''
+    Alias maps from comic_aliases.json
+
+      text: replaced anywhere in an episode description before NER
+            (nicknames such as Wic+Div)
+      labels: whole timestamp labels that stand for a comic title
+              (mostly interview segments)
+    '''
+
+    global _aliases
+
+    if path is None:
+        path = aliases_file
+
+    with open(path, 'r') as fp:
+        _aliases = json.loads(fp.read())
+
+    return _aliases
+
+
+def get_aliases():
+    if _aliases is None:
+        load_aliases()
+
+    return _aliases
+
+
+def normalize(title):
+    # lowercase, '&' as 'and', no punctuation, single spaces, no leading 'the'
+    title = title.lower().replace('&', ' and ')
+    title = re.sub(r"['’]", '', title) # they're, they’re -> theyre
+    title = re.sub(r'[^\w\s]|_', ' ', title)
+    title = re.sub(r'\bvolume\b', 'vol', title)
+    title = re.sub(r'^\s*the\b', '', title)
+
+    return ' '.join(title.split())
+
+
+def get_grams(norm):
+    # character trigrams, padded so short titles and word starts count
+    padded = f'  {norm} '
+
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def get_numbers(norm):
+    # issue / volume numbers have to agree ('Saga 54' is not 'Saga 55'),
+    # so do roman numerals, single letters ('Dragon Ball Z') and 'vol'
+    return [word for word in norm.split() if re.fullmatch(r'\d+|[ivx]+|\w|vol', word)]
+
+
+class TitleIndex:
+    '''
+    Connection to the canonical title index
+
+    Use canonical() to map titles onto known ones and add() to register new
+    ones. Close when done (or use as a context manager).
+    '''
+
+    def __init__(self, path=table_store.db_file):
+        self.con = table_store.connect(path)
+
+        for statement in schema:
+            self.con.execute(statement)
+
+        n, = self.con.execute('SELECT COUNT(*) FROM comic_titles').fetchone()
+
+        if n == 0:
+            self.build()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.con.close()
+
+    def build(self):
+        # index every title in the comics table, plus the aliases
+        with self.con:
+            self.con.execute('DELETE FROM comic_titles')
+            self.con.execute('DELETE FROM comic_grams')
+            self.con.execute('DELETE FROM comic_aliases')
+
+            # the most common spelling of each normalized title is canonical
+            rows = self.con.execute('''SELECT comic FROM comics WHERE comic IS NOT NULL
+                                       GROUP BY comic ORDER BY COUNT(*) DESC, MIN(seq)''').fetchall()
+
+            self._add([str(comic) for comic, in rows])
+
+            aliases = get_aliases()
+
+            for alias, title in list(aliases['text'].items()) + list(aliases['labels'].items()):
+                self._add([title])
+                self.con.execute('INSERT OR REPLACE INTO comic_aliases VALUES (?, ?)',
+                                 (normalize(alias), title))
+
+    def _add(self, titles):
+        added = 0
+
+        for title in titles:
+            norm = normalize(title)
+
+            if norm == '':
+                continue
+
+            grams = get_grams(norm)
+
+            cur = self.con.execute('INSERT OR IGNORE INTO comic_titles (title, norm, grams) VALUES (?, ?, ?)',
+                                   (title, norm, len(grams)))
+
+            # already known
+            if cur.rowcount == 0:
+                continue
+
+            self.con.executemany('INSERT INTO comic_grams VALUES (?, ?)',
+                                 [(gram, cur.lastrowid) for gram in grams])
+            added += 1
+
+        return added
+
+    def add(self, titles):
+        # register new titles, returns how many were not known yet
+        with self.con:
+            return self._add(titles)
+
+    def lookup(self, title):
+        '''
+        Closest known title
+
+        Output: (known title, similarity), or (None, 0.0) if nothing is
+        similar enough
+        '''
+
+        norm = normalize(title)
+
+        if norm == '':
+            return None, 0.0
+
+        row = self.con.execute('SELECT title FROM comic_aliases WHERE alias = ?', (norm,)).fetchone()
+
+        if row is None:
+            row = self.con.execute('SELECT title FROM comic_titles WHERE norm = ?', (norm,)).fetchone()
+
+        if row is not None:
+            return row[0], 1.0
+
+        grams = get_grams(norm)
+        marks = ', '.join('?' for gram in grams)
+
+        # postings of this title's trigrams only
+        candidates = self.con.execute(f'''SELECT t.title, t.norm, t.grams, COUNT(*) AS shared
+                                          FROM comic_grams g JOIN comic_titles t ON t.id = g.title_id
+                                          WHERE g.gram IN ({marks})
+                                          GROUP BY g.title_id
+                                          ORDER BY shared DESC, t.id
+                                          LIMIT ?''',
+                                      (*grams, max_candidates)).fetchall()
+
+        best, best_sim = None, 0.0
+        numbers = get_numbers(norm)
+
+        for known, known_norm, known_grams, shared in candidates:
+            sim = 2 * shared / (len(grams) + known_grams)
+
+            if sim > best_sim and get_numbers(known_norm) == numbers:
+                best, best_sim = known, sim
+
+        if best_sim < min_similarity:
+            return None, 0.0
+
+        return best, best_sim
+
+    def canonical(self, title):
+        # known title if there is one, otherwise the title as given
+        known, sim = self.lookup(title)
+
+        return title if known is None else known
+
+
+def canonical_rows(rows, path=table_store.db_file):
+    '''
+    Replace the comic in each comics table row with its canonical title
+
+    Rows of the same episode that end up with the same title are merged,
+    keeping the first.
+
+    Input: list of records.ComicMention
+    Output: list of records.ComicMention
+    '''
+
+    out = list()
+    seen = set()
+
+    with TitleIndex(path) as index:
+        for row in rows:
+            row = row._replace(comic=index.canonical(row.comic))
+
+            if (row.show_id, row.comic) not in seen:
+                seen.add((row.show_id, row.comic))
+                out.append(row)
+
+    return out
+
+
+def add_titles(titles, path=table_store.db_file):
+    # register titles newly added to the comics table
+    with TitleIndex(path) as index:
+        return index.add(titles)
+
+
+def rebuild(path=table_store.db_file):
+    # index the comics table from scratch
+    with TitleIndex(path) as index:
+        index.build()
+
+        n, = index.con.execute('SELECT COUNT(*) FROM comic_titles').fetchone()
+
+    return n
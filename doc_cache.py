@@ -0,0 +1,120 @@
+import hashlib
+import sqlite3
+import time
+from contextlib import closing
+
+### global variables ###
+cache_file = 'doc_cache.db'
+max_bytes = 512 * 1024 * 1024
+# size cap, least recently used docs are evicted past this
+
+hits = 0
+misses = 0
+# counters for this process
+
+
+def get_key(text, model, version, disable=()):
+    # docs depend on the text, the model and which components ran
+    disabled = ','.join(sorted(disable))
+    key = '\0'.join([model, version, disabled, text])
+
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def connect(path=cache_file):
+    con = sqlite3.connect(path)
+    con.execute('''CREATE TABLE IF NOT EXISTS docs (
+                       key TEXT PRIMARY KEY,
+                       data BLOB NOT NULL,
+                       size INTEGER NOT NULL,
+                       used REAL NOT NULL)''')
+    con.execute('CREATE INDEX IF NOT EXISTS docs_used ON docs (used)')
+
+    return con
+
+
+def get_many(keys, path=cache_file):
+    '''
+    Look up serialized docs
+
+    Input: list of keys
+    Output: dict {key: DocBin bytes} for the keys that were cached
+    '''
+
+    global hits, misses
+
+    found = dict()
+
+    with closing(connect(path)) as con:
+        with con:
+            for key in set(keys):
+                row = con.execute('SELECT data FROM docs WHERE key = ?', (key,)).fetchone()
+
+                if row is not None:
+                    found[key] = row[0]
+
+            # mark as recently used
+            now = time.time()
+            con.executemany('UPDATE docs SET used = ? WHERE key = ?',
+                            [(now, key) for key in found])
+
+    hits += sum(1 for key in keys if key in found)
+    misses += sum(1 for key in keys if key not in found)
+
+    return found
+
+
+def put_many(items, path=cache_file):
+    '''
+    Save serialized docs, then evict down to max_bytes
+
+    Input: dict {key: DocBin bytes}
+    '''
+
+    now = time.time()
+
+    with closing(connect(path)) as con:
+        with con:
+            con.executemany('INSERT OR REPLACE INTO docs (key, data, size, used) VALUES (?, ?, ?, ?)',
+                            [(key, data, len(data), now) for key, data in items.items()])
+
+            evict(con)
+
+
+def evict(con):
+    total, = con.execute('SELECT COALESCE(SUM(size), 0) FROM docs').fetchone()
+
+    if total <= max_bytes:
+        return
+
+    # drop least recently used docs until we're under the cap
+    drop = list()
+
+    for key, size in con.execute('SELECT key, size FROM docs ORDER BY used'):
+        if total <= max_bytes:
+            break
+
+        drop.append((key,))
+        total -= size
+
+    con.executemany('DELETE FROM docs WHERE key = ?', drop)
+
+
+def to_bytes(doc):
+    from spacy.tokens import DocBin
+
+    docs = DocBin(docs=[doc])
+
+    return docs.to_bytes()
+
+
+def from_bytes(data, vocab):
+    from spacy.tokens import DocBin
+
+    docs = DocBin().from_bytes(data)
+
+    return list(docs.get_docs(vocab))[0]
+
+
+def stats():
+    return {'hits': hits, 'misses': misses}
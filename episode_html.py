@@ -0,0 +1,61 @@
+import os
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+### global variables ###
+html_parser = os.environ.get('IRCB_HTML_PARSER', 'html.parser')
+# BeautifulSoup backend. 'lxml' is faster, but wraps plain-text summaries in
+# <p> tags, which changes what get_bullets sees for older episodes
+
+
+class BulletList(NamedTuple):
+    text: str # text of the whole <ul>
+    items: list # (text, is_leaf) for every <li> inside, nested ones included
+
+
+class Paragraph(NamedTuple):
+    text: str # as in p.text
+    spaced: str # as in p.get_text(separator=' ')
+    next_list: Optional[int] # index in lists of the first <ul> after this <p>
+
+
+class Summary(NamedTuple):
+    '''
+    One episode description, parsed once
+
+    Holds everything get_episodes and get_comics read from the HTML, so
+    neither needs its own soup or repeated find_all walks.
+    '''
+    raw: str
+    text: str # as in soup.text
+    lines: list # text.split('\n')
+    paragraphs: list # Paragraph for every <p>
+    lists: list # BulletList for every <ul>
+
+
+@lru_cache(maxsize=1024)
+def parse_summary(summary_raw):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(summary_raw, features=html_parser)
+
+    lists = list()
+    list_index = dict()
+
+    for ul in soup.find_all('ul'):
+        items = [(li.text, li.find('li') is None) for li in ul.find_all('li')]
+
+        list_index[id(ul)] = len(lists)
+        lists.append(BulletList(ul.text, items))
+
+    paragraphs = list()
+
+    for p in soup.find_all('p'):
+        ul = p.find_next('ul')
+        next_list = None if ul is None else list_index[id(ul)]
+
+        paragraphs.append(Paragraph(p.text, p.get_text(separator=' '), next_list))
+
+    text = soup.text
+
+    return Summary(summary_raw, text, text.split('\n'), paragraphs, lists)
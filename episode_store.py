@@ -0,0 +1,300 @@
+import json
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from email.utils import parsedate_to_datetime
+
+### global variables ###
+store_file = 'public_feed.db'
+legacy_file = 'public_feed.json'
+# entries are keyed by the feed id / show_id, never by position in the feed.
+# seq only records insertion order (oldest first), so new episodes are appended
+# and existing rows are never renumbered
+
+fields = ['id', 'title', 'subtitle', 'links', 'published', 'authors', 'tags',
+          'content', 'summary', 'itunes_episode', 'feed']
+sub_fields = {'links': ['href'],
+              'authors': ['name'],
+              'tags': ['term'],
+              'content': ['value']}
+# the parts of a feed entry the parsers read, everything else is dropped.
+# feed is the name of the feed the entry came from (see feeds.py)
+
+compress = False
+# zlib-compress the stored JSON: about 4x smaller than uncompressed, but
+# slower to load. Either form is read back, so this can be switched at any
+# time (compact() re-encodes existing entries)
+
+archive = False
+archive_file = 'public_feed_raw.db'
+# opt in to also keeping every raw feedparser entry, as downloaded
+
+store_version = 1
+# PRAGMA user_version of a store holding projected entries
+
+
+def get_show_id(entry):
+    show_id = entry['id']
+
+    # if the show_id is a url, just keep the number
+    if 'ircb' in show_id:
+        show_id = show_id.split('?p=')[-1]
+
+    return show_id
+
+
+def get_published(entry):
+    # publication date of an entry, from any RFC 822 date (+0000, GMT, ...)
+    return parsedate_to_datetime(entry['published']).date()
+
+
+def project(entry):
+    '''
+    Compact copy of a feed entry
+
+    Keeps only fields (and sub_fields of list fields), in the same shape as
+    the feedparser entry, so parsers read it the same way.
+    '''
+
+    slim = dict()
+
+    for field in fields:
+        if field not in entry:
+            continue
+
+        value = entry[field]
+
+        if field in sub_fields:
+            value = [dict((key, item[key]) for key in sub_fields[field] if key in item)
+                     for item in value]
+
+        slim[field] = value
+
+    return slim
+
+
+def encode(entry):
+    data = json.dumps(entry)
+
+    if compress:
+        return zlib.compress(data.encode('utf-8'))
+
+    return data
+
+
+def decode(data):
+    # stored JSON, compressed or not
+    if isinstance(data, bytes):
+        data = zlib.decompress(data).decode('utf-8')
+
+    return json.loads(data)
+
+
+def connect(path=store_file):
+    seed = not os.path.exists(path)
+
+    con = sqlite3.connect(path)
+    con.execute('''CREATE TABLE IF NOT EXISTS entries (
+                       seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                       id TEXT NOT NULL UNIQUE,
+                       show_id TEXT NOT NULL UNIQUE,
+                       data TEXT NOT NULL)''')
+
+    # first use: start from the old positional dump
+    if seed and os.path.exists(legacy_file):
+        with open(legacy_file, 'r') as fp:
+            rss = json.loads(fp.read())
+
+        # 0 is newest episode
+        entries = [rss[i] for i in sorted(rss, key=int)]
+        _upsert(con, entries)
+        con.execute(f'PRAGMA user_version = {store_version}')
+        con.commit()
+
+        if archive:
+            archive_entries(entries)
+
+    version, = con.execute('PRAGMA user_version').fetchone()
+
+    # stores from before projection hold whole feedparser entries
+    if version < store_version:
+        _compact(con)
+        con.execute(f'PRAGMA user_version = {store_version}')
+        con.commit()
+
+    return con
+
+
+def _compact(con):
+    # rewrite every entry projected, in the current encoding
+    rows = con.execute('SELECT seq, data FROM entries').fetchall()
+
+    con.executemany('UPDATE entries SET data = ? WHERE seq = ?',
+                    [(encode(project(decode(data))), seq) for seq, data in rows])
+
+
+def compact(path=store_file):
+    # re-encode the whole store (eg, after switching compress) and shrink the file
+    with closing(connect(path)) as con:
+        with con:
+            _compact(con)
+
+        con.execute('VACUUM')
+
+
+def archive_entries(entries, path=None):
+    '''
+    Keep raw feed entries, as downloaded
+
+    Only the latest copy of each entry (by id) is kept.
+    '''
+
+    if path is None:
+        path = archive_file
+
+    with closing(sqlite3.connect(path)) as con:
+        with con:
+            con.execute('''CREATE TABLE IF NOT EXISTS raw (
+                               id TEXT PRIMARY KEY,
+                               data BLOB NOT NULL)''')
+            con.executemany('INSERT OR REPLACE INTO raw (id, data) VALUES (?, ?)',
+                            [(entry['id'], zlib.compress(json.dumps(entry).encode('utf-8')))
+                             for entry in entries])
+
+
+def _upsert(con, entries):
+    changed = dict()
+
+    # entries arrive newest first, append oldest first
+    for entry in reversed(list(entries)):
+        # compare in the same form the entry will be saved in
+        entry = json.loads(json.dumps(project(entry)))
+        data = encode(entry)
+        show_id = get_show_id(entry)
+
+        row = con.execute('SELECT data FROM entries WHERE id = ?',
+                          (entry['id'],)).fetchone()
+
+        if row is None:
+            con.execute('INSERT INTO entries (id, show_id, data) VALUES (?, ?, ?)',
+                        (entry['id'], show_id, data))
+        elif decode(row[0]) != entry:
+            con.execute('UPDATE entries SET data = ? WHERE id = ?',
+                        (data, entry['id']))
+        else:
+            continue
+
+        changed[show_id] = entry
+
+    return changed
+
+
+def upsert(entries, path=store_file):
+    '''
+    Add new entries and replace changed ones
+
+    Entries are stored projected (see project). With archive on, the raw
+    entries are also saved to archive_file.
+
+    Input: list of feed entries (newest first)
+    Output: dict of new or changed entries {show_id: entry}
+    '''
+
+    entries = list(entries)
+
+    with closing(connect(path)) as con:
+        with con:
+            changed = _upsert(con, entries)
+
+    if archive:
+        archive_entries(entries)
+
+    return changed
+
+
+def show_ids(path=store_file):
+    with closing(connect(path)) as con:
+        rows = con.execute('SELECT show_id FROM entries').fetchall()
+
+    return set(show_id for show_id, in rows)
+
+
+def get(ids, path=store_file):
+    '''
+    Look up entries by show_id
+
+    Output: dict {show_id: entry}, newest first
+    '''
+
+    rss = dict()
+
+    with closing(connect(path)) as con:
+        for show_id in ids:
+            row = con.execute('SELECT seq, data FROM entries WHERE show_id = ?',
+                              (str(show_id),)).fetchone()
+
+            if row is not None:
+                rss[str(show_id)] = row
+
+    # newest first, same order as the feed
+    rss = sorted(rss.items(), key=lambda item: item[1][0], reverse=True)
+
+    return dict((show_id, decode(data)) for show_id, (seq, data) in rss)
+
+
+def load(path=store_file):
+    '''
+    All stored entries
+
+    Output: dict {show_id: entry}, newest first
+    '''
+
+    with closing(connect(path)) as con:
+        rows = con.execute('SELECT show_id, data FROM entries ORDER BY seq DESC')
+
+        rss = dict((show_id, decode(data)) for show_id, data in rows)
+
+    return rss
+
+
+def iterate(ids=None, oldest_first=False, path=store_file):
+    '''
+    Stored entries one at a time, without loading the whole store
+
+    Input: show_ids to keep (None for all)
+    Output: generator of (show_id, entry), newest first unless oldest_first
+    '''
+
+    order = 'ASC' if oldest_first else 'DESC'
+
+    if ids is not None:
+        ids = set(str(show_id) for show_id in ids)
+
+    with closing(connect(path)) as con:
+        for show_id, data in con.execute(f'SELECT show_id, data FROM entries ORDER BY seq {order}'):
+            if ids is None or show_id in ids:
+                yield show_id, decode(data)
+
+
+def count(path=store_file):
+    with closing(connect(path)) as con:
+        n, = con.execute('SELECT COUNT(*) FROM entries').fetchone()
+
+    return n
+
+
+def newest(n=1, path=store_file):
+    '''
+    Most recently added entries
+
+    Output: dict {show_id: entry}, newest first
+    '''
+
+    with closing(connect(path)) as con:
+        rows = con.execute('SELECT show_id, data FROM entries ORDER BY seq DESC LIMIT ?',
+                           (n,))
+
+        rss = dict((show_id, decode(data)) for show_id, data in rows)
+
+    return rss
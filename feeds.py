@@ -0,0 +1,264 @@
+'''
+Concurrent sync of every configured RSS feed
+
+Feeds are listed in feeds.json, each with a name and either a url or
+url_env, the environment variable holding the url (for private feeds such as
+Patreon, whose url includes a token). Feeds without a url are skipped.
+
+All feeds are downloaded at once with asyncio. aiohttp is optional: if it
+is installed, the requests share one connection pool; otherwise each request
+runs urllib in a worker thread, on a connection of its own. Each
+request sends the feed's validators from the last sync, has a timeout, and
+is retried with backoff on connection errors and 5xx / 429 responses.
+Entries are tagged with the name of their feed ('feed') and written to the
+episode store, so they go through the same parsing as any other episode.
+'''
+
+import asyncio
+import json
+import os
+from typing import NamedTuple, Optional
+
+# custom scripts
+import episode_store
+import instrument
+
+### global variables ###
+feeds_file = 'feeds.json'
+state_file = 'feed_state.json'
+# validators (ETag / Last-Modified) per feed name, from the last successful download
+
+timeout = 30
+# seconds per request
+retries = 3
+retry_delay = 2
+# seconds before the first retry, doubled after each
+max_connections = 8
+# size of the shared connection pool (aiohttp only)
+
+
+class FeedResult(NamedTuple):
+    name: str
+    status: Optional[int] # HTTP status, None if every attempt failed
+    body: Optional[bytes]
+    etag: Optional[str]
+    modified: Optional[str]
+    error: Optional[str]
+
+
+def load_feeds(path=None):
+    '''
+    Feeds from feeds.json that have a url
+
+    Output: list of dicts with name and url
+    '''
+
+    if path is None:
+        path = feeds_file
+
+    with open(path, 'r') as fp:
+        config = json.loads(fp.read())
+
+    feeds = list()
+
+    for feed in config:
+        url = feed.get('url') or os.environ.get(feed.get('url_env', ''), '')
+
+        if url == '':
+            print(f'Skipping feed {feed["name"]}: no url (set {feed.get("url_env")})')
+            continue
+
+        feeds.append({'name': feed['name'], 'url': url})
+
+    return feeds
+
+
+def load_state():
+    # validators saved by the last sync, {feed name: {etag, modified}}
+    if not os.path.exists(state_file):
+        return dict()
+
+    with open(state_file, 'r') as fp:
+        state = json.loads(fp.read())
+
+    # written by a single-feed sync: validators of the public feed
+    if 'etag' in state or 'modified' in state:
+        state = {'public': state}
+
+    return state
+
+
+def save_state(state):
+    with open(state_file, 'w') as fp:
+        fp.write(json.dumps(state))
+
+
+def get_headers(validators):
+    headers = {'User-Agent': 'ircb-feeds'}
+
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+
+    if validators.get('modified'):
+        headers['If-Modified-Since'] = validators['modified']
+
+    return headers
+
+
+def _errors():
+    # failures worth retrying
+    try:
+        import aiohttp
+    except ImportError:
+        return (OSError, asyncio.TimeoutError)
+
+    return (OSError, asyncio.TimeoutError, aiohttp.ClientError)
+
+
+def _retry(status):
+    # worth trying again: rate limits and server errors
+    return status == 429 or (status is not None and status >= 500)
+
+
+async def _get_aiohttp(session, url, headers):
+    async with session.get(url, headers=headers) as response:
+        body = await response.read() if response.status == 200 else None
+
+        return response.status, body, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def _get_urllib(url, headers):
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(url, headers=headers)
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+    # non-2xx, including 304
+    except urllib.error.HTTPError as e:
+        return e.code, None, e.headers.get('ETag'), e.headers.get('Last-Modified')
+
+
+async def fetch(session, feed, validators):
+    '''
+    Download one feed, retrying with backoff
+
+    session is an aiohttp.ClientSession, or None to use urllib in a thread.
+
+    Output: FeedResult
+    '''
+
+    headers = get_headers(validators)
+    errors = _errors()
+    error = None
+    status = None
+
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(retry_delay * 2 ** (attempt - 1))
+
+        try:
+            if session is None:
+                status, body, etag, modified = await asyncio.wait_for(
+                    asyncio.to_thread(_get_urllib, feed['url'], headers), timeout)
+            else:
+                status, body, etag, modified = await _get_aiohttp(session, feed['url'], headers)
+
+        except errors as e:
+            status, error = None, repr(e)
+            continue
+
+        if not _retry(status):
+            return FeedResult(feed['name'], status, body, etag, modified, None)
+
+        error = f'HTTP {status}'
+
+    return FeedResult(feed['name'], status, None, None, None, error)
+
+
+async def fetch_all(feeds, state):
+    # every feed at once, over one connection pool with aiohttp, or one thread per feed without
+    try:
+        import aiohttp
+    except ImportError:
+        aiohttp = None
+
+    validators = [state.get(feed['name'], dict()) for feed in feeds]
+
+    if aiohttp is None:
+        return await asyncio.gather(*[fetch(None, feed, v) for feed, v in zip(feeds, validators)])
+
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        return await asyncio.gather(*[fetch(session, feed, v) for feed, v in zip(feeds, validators)])
+
+
+def sync(feeds=None):
+    '''
+    Incremental download of every feed
+
+    Unchanged feeds are a 304 with no body. Entries of changed feeds are
+    tagged with the feed name and only new or changed ones are written to
+    the episode store.
+
+    Input: list of feeds (name, url), default from feeds.json
+    Output: dict of new or changed entries {show_id: entry}, all feeds
+    '''
+
+    import feedparser
+
+    if feeds is None:
+        feeds = load_feeds()
+
+    state = load_state()
+
+    with instrument.stage('feed_download'):
+        results = asyncio.run(fetch_all(feeds, state))
+
+    changed = dict()
+
+    for result in results:
+        if result.status == 304:
+            print(f'{result.name}: not modified since last sync.')
+            continue
+
+        if result.status != 200:
+            print(f'{result.name}: failed to get RSS feed. Status code: {result.status} ({result.error})')
+            instrument.count('feeds_failed')
+            continue
+
+        feed = feedparser.parse(result.body)
+
+        for entry in feed.entries:
+            entry['feed'] = result.name
+
+        print(f'{result.name}: {len(feed.entries)} episodes found')
+        instrument.count('feed_entries', len(feed.entries))
+
+        with instrument.stage('store_write'):
+            new = episode_store.upsert(feed.entries)
+
+        print(f'{result.name}: {len(new)} new or changed episodes written to store.')
+        changed.update(new)
+
+        # only remember validators once the data is saved
+        state[result.name] = {'etag': result.etag, 'modified': result.modified}
+        save_state(state)
+
+    instrument.count('episodes_changed', len(changed))
+
+    return changed
+
+
+def main():
+    sync()
+
+
+if __name__ == "__main__":
+    with instrument.run('feeds'):
+        main()
@@ -0,0 +1,124 @@
+'''
+Batched Jaro-Winkler similarity
+
+Scores are the same as nltk's jaro_winkler_similarity (p=0.1, max_l=4, with
+the prefix bonus applied at any Jaro score), but computed for every pair of
+strings in one call: Jaro with rapidfuzz's cdist, the prefix bonus with numpy.
+Without rapidfuzz installed, this falls back to nltk one pair at a time.
+'''
+
+import numpy as np
+
+### global variables ###
+prefix_weight = 0.1
+max_prefix = 4
+
+
+def _prefix_length(first, second):
+    # common prefix length of one pair, up to max_prefix
+    length = 0
+
+    for a, b in zip(first[:max_prefix], second[:max_prefix]):
+        if a != b:
+            break
+
+        length += 1
+
+    return length
+
+
+def _prefix_lengths(queries, choices):
+    # common prefix length of every (query, choice) pair, up to max_prefix
+    def codes(strings, pad):
+        out = np.full((len(strings), max_prefix), pad, dtype=np.int64)
+
+        for i, string in enumerate(strings):
+            for j, char in enumerate(string[:max_prefix]):
+                out[i, j] = ord(char)
+
+        return out
+
+    # different padding, so padding never counts as a match
+    same = codes(queries, -1)[:, None, :] == codes(choices, -2)[None, :, :]
+
+    return np.cumprod(same, axis=2).sum(axis=2)
+
+
+def similarity_matrix(queries, choices):
+    '''
+    Jaro-Winkler similarity of every query against every choice
+
+    Input: list of strings, list of strings
+    Output: array of shape (len(queries), len(choices))
+    '''
+
+    queries = list(queries)
+    choices = list(choices)
+
+    if len(queries) == 0 or len(choices) == 0:
+        return np.zeros((len(queries), len(choices)))
+
+    try:
+        from rapidfuzz.distance import Jaro
+        from rapidfuzz.process import cdist
+
+    except ImportError:
+        from nltk.metrics.distance import jaro_winkler_similarity
+
+        return np.array([[jaro_winkler_similarity(query, choice) for choice in choices]
+                         for query in queries])
+
+    jaro = cdist(queries, choices, scorer=Jaro.similarity, dtype=np.float64)
+    prefix = _prefix_lengths(queries, choices)
+
+    return jaro + prefix * prefix_weight * (1 - jaro)
+
+
+def similarity_pairs(first, second):
+    '''
+    Jaro-Winkler similarity of first[i] and second[i], for every i
+
+    Output: array of shape (len(first),)
+    '''
+
+    first = list(first)
+    second = list(second)
+
+    if len(first) == 0:
+        return np.zeros(0)
+
+    try:
+        from rapidfuzz.distance import Jaro
+        from rapidfuzz.process import cpdist
+
+    except ImportError:
+        from nltk.metrics.distance import jaro_winkler_similarity
+
+        return np.array([jaro_winkler_similarity(a, b) for a, b in zip(first, second)])
+
+    jaro = cpdist(first, second, scorer=Jaro.similarity, dtype=np.float64)
+    prefix = np.array([_prefix_length(a, b) for a, b in zip(first, second)])
+
+    return jaro + prefix * prefix_weight * (1 - jaro)
+
+
+def best_match(queries, choices):
+    '''
+    Most similar choice for each query
+
+    Ties go to the first choice. Queries with no similarity to any choice
+    get no match.
+
+    Output: list of (choice index or None, similarity), one per query
+    '''
+
+    sims = similarity_matrix(queries, choices)
+
+    if sims.shape[1] == 0:
+        return [(None, 0.0) for query in queries]
+
+    best = sims.argmax(axis=1)
+    scores = sims[np.arange(len(best)), best]
+
+    return [(int(i), float(score)) if score > 0 else (None, 0.0)
+            for i, score in zip(best, scores)]
@@ -1,229 +1,235 @@
 import json
 import re
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from bs4 import BeautifulSoup
 
-from nltk.metrics.distance import jaro_winkler_similarity
-
-import spacy
+# custom scripts
+import comic_index
+import episode_html
+import episode_store
+import fuzzy
+import instrument
+import ner
+import search_index
+import table_store
+from records import ComicMention, Stamp, Timestamp, to_frame
 
 ##### Global variables
-nlp = spacy.load("en_core_web_trf")
+ner_disable = ['tagger', 'parser', 'attribute_ruler', 'lemmatizer', 'no_possesive']
+# only WORK_OF_ART entities are needed, as found by the plain model
 old_format_start = datetime(2017, 9, 20).date()
 # episodes before Sept 20, 2017 had a different format
 # data needs to be extracted differently
 
+pool_workers = 1
+chunk_size = 16
+# worker processes for HTML extraction / matching in parse_episodes (1 = no pool)
+
+canonical_titles = True
+# map comics onto known titles with comic_index
+
+stamp_pattern = re.compile(r'(\d{1,2})[:;](\d{2})(?:[:;](\d{2}))?(?!\d|[:;]\d)')
+# hh:mm:ss or mm:ss, also when glued to the text around it ('#1-300:19:26'
+# is '#1-3' then 00:19:26). Starts with a digit, so the scan skips ahead to
+# digits
+separators = ' \t\xa0*•·-–—−:|'
+# bullets, dashes and colons around a timestamp's label
+goodreads_prefix = re.compile(r'^[^-–—−:]*goodreads[^-–—−:]*[-–—−:]\s*', re.IGNORECASE)
+# 'IRCB Goodreads Book of the Month: ' before the title of the book
+
+terms_file = 'comic_terms.json'
+_terms = None
+# compiled search terms, see load_terms
+
+
+def load_terms(path=None):
+    '''
+    Search terms from comic_terms.json, compiled once
+
+    Each list is a set of regular expressions (mostly plain phrases) matched
+    case-insensitively anywhere in the text:
+      comic_heads: text that indicates a list of comics might follow
+                   ('discussed', 'recommendations' and 'recommended' give some
+                   false positives)
+      non_comic_tags: things that are not comic titles, compiled by manually
+                      inspecting text after timestamps ('kickstarters' only,
+                      the singular is okay)
+      timestamp_stops: extra text that ends a plain-text timestamp list
+    '''
+
+    global _terms
+
+    if path is None:
+        path = terms_file
+
+    with open(path, 'r') as fp:
+        terms = json.loads(fp.read())
+
+    heads = '|'.join(terms['comic_heads'])
+    non = '|'.join(terms['non_comic_tags'])
+    stops = '|'.join(terms['comic_heads'] + terms['timestamp_stops'])
+
+    _terms = {'heads': re.compile(heads, re.IGNORECASE),
+              'non': re.compile(non, re.IGNORECASE),
+              'stops': re.compile(stops, re.IGNORECASE)}
+
+    return _terms
 
-def get_comic_heads():
-	# text that indicates a list of comics might follow
-
-    heads_list = ['discussed', # some false positives
-                  'comic picks',
-                  'comics read',
-                  'comic reads',
-                  'what we read',
-                  'picks for this week',
-                  'recommendations', # some false positives
-                  'recommended', # some false positives
-                  'comics mentioned',
-                  'manga mentioned',
-                  'reading next',
-                  'top of our pile',
-                  'top of my pile',
-                  'top of your pile',
-                  'comics we loved',
-                  'top comics',
-                  'what we read']
-
-    heads = '|'.join(heads_list)
-    
-    return heads
 
+def _get_terms():
+    if _terms is None:
+        load_terms()
 
+    return _terms
+
+
+def get_comic_heads():
+    # compiled pattern: text that indicates a list of comics might follow
+    return _get_terms()['heads']
 
 
 def get_non_comic_tags():
-    # search strings for things that are not comic titles
-    # compiled by manually inspecting text after timestamps
-    noncomic_tags = ['last week in comics',
-                     'intro',
-                     '\\bstart\\b',
-                     'wrap', 
-                     'credits', 
-                     'picks',
-                     'interview with', 
-                     'chatting with',
-                     'ircb', 
-                     'kickstarters', #note: singular okay
-                     'top of our pile', 
-                     'top of the pile', 'top of your pile', 
-                     'west michigan weather watch',
-                     '\\bbreak\\b', 
-                     'podcast',
-                     'reading', 
-                     'warning', 
-                     'listener', 
-                     'been digging']
-
-    non = '|'.join(noncomic_tags)
-    
-    return non
+    # compiled pattern: things that are not comic titles
+    return _get_terms()['non']
 
 
+def get_timestamp_stops():
+    # compiled pattern: text that ends a plain-text list of timestamps
+    return _get_terms()['stops']
 
-def get_timestamps(soup, url):
-    # extract text after timestamps for a given episode
 
-    timestamps = dict()
+def clean_label(label):
+    # label without bullets, dashes or a Goodreads prefix, '–' as '-'
+    label = label.replace('–', '-').strip(separators)
 
-    heads = get_comic_heads() # search string for comic headers
-    
-    # first, look for bulletted lists
-    for item in soup.find_all('ul'):
+    return goodreads_prefix.sub('', label).strip(separators)
+
+
+def lex_stamps(line, stops=None, record=True):
+    '''
+    Timestamped labels in one line of text
+
+    One scan for timestamps; labels follow their timestamp ('00:12:34 -
+    Saga #1'), or come before it when the line ends on a timestamp
+    ('* Saga #1 - 00:12:34'). A label runs to the next timestamp, so several
+    timestamps glued into one line are split up.
+
+    With stops (compiled pattern), the line is part of a plain-text list
+    that a stop ends: the timestamp whose label holds a stop is dropped, and
+    so are the ones after, until a list starts again at 00:00:00.
+
+    Input: line, stops, whether a list is already being read
+    Output: list of records.Stamp, whether the list goes on after this line
+    '''
+
+    times = list(stamp_pattern.finditer(line))
+
+    if len(times) == 0:
+        return list(), record and (stops is None or stops.search(line) is None)
 
-        # only if this list starts with a timestamp
+    found = list() if stops is None else [stop.start() for stop in stops.finditer(line)]
+
+    label_first = (line[:times[0].start()].strip(separators) != ''
+                   and line[times[-1].end():].strip(separators) == '')
+
+    stamps = list()
+
+    for n, token in enumerate(times):
+        if label_first:
+            start = times[n - 1].end() if n > 0 else 0
+            end = token.start()
+        else:
+            start = token.end()
+            end = times[n + 1].start() if n + 1 < len(times) else len(line)
+
+        # a stop before the first timestamp (and its label) ends the list read so far
+        if n == 0 and any(stop < min(start, token.start()) for stop in found):
+            record = False
+
+        first, second, third = token.groups()
+
+        if third is None: # mm:ss
+            h, m, s = '00', first, second
+        else:
+            h, m, s = first, second, third
+
+        seconds = int(h) * 3600 + int(m) * 60 + int(s)
+
+        if seconds == 0:
+            record = True
+
+        # a stop in the label ends the list at this timestamp
+        if any(start <= stop < end for stop in found):
+            record = False
+
+        label = clean_label(line[start:end])
+
+        if record and label != '':
+            stamps.append(Stamp(token.group().replace(';', ':'), label, seconds))
+
+    return stamps, record
+
+
+def get_timestamps(summary, url):
+    # extract text after timestamps for a given episode (episode_html.Summary)
+
+    stops = get_timestamp_stops()
+    labels = comic_index.get_aliases()['labels']
+
+    stamps = list()
+
+    # first, look for bulletted lists that start with a timestamp
+    for item in summary.lists:
         if item.text[0].isdigit():
-            for stamp in item.find_all('li'):
-                
-                # special cases 
-                if url == 'https://ircbpodcast.simplecast.com/episodes/books-dense-enough-for-killing-nEPrn9MT':
-                    words = stamp.text.split()
-                    time = words[0]
-                    text = ' '.join(words[1:])
-                    
-                    split_stamp = [time, text]
-                    
-                # All other cases
-                else:
-                    # make all dashes the same character
-                    stamp_text = stamp.text.replace('–', '-')
-                    split_stamp = stamp_text.split('-')
-
-                    # check we have enough items
-                    if len(split_stamp) < 2:
-                        if split_stamp[0] == 'Wrap/Credits': # special case
-                            split_stamp = ['01:00:00', 'Wrap/Credits']
-                        else:
-                            split_stamp = stamp_text.split(':')
-                            time = ':'.join([val for val in split_stamp if val.isdigit()])
-                            text = ' '.join([val for val in split_stamp if not val.isdigit()])
-
-                            split_stamp = [time, text]
-
-                clean_stamp = split_stamp[0].strip()
-
-                if clean_stamp == '':
-                    clean_stamp = 'z' # just so there's a character
-
-                # only if this item is timestamp
-                if clean_stamp[0].isdigit():
-
-                    try:
-                        h,m,s = clean_stamp.split(':')
-                    except:
-                        # some items just have mm:ss
-                        m, s = clean_stamp.split(':')
-                        h = '00'
-
-                    timestamp = f'{h}h{m}m{s}s'
-
-                    # clean goodreads text so just comic name
-                    if 'goodreads' in split_stamp[1].lower():
-                        rest = '-'.join(split_stamp[2:])
-                    else:
-                        rest = '-'.join(split_stamp[1:])
-
-                    rest = rest.strip()
-
-                    # special cases
-                    if rest == 'Top of Our Pile / The Biggest Volume Ever (One Piece)':
-                        rest = 'One Piece'
-                    elif rest == 'Crackle: An Interview with Phillip Maira':
-                        rest = 'Crackle Vol. 3'
-                    elif rest == 'Orcs in Space! An Interview with Francois Vigneault and Michael Tanner':
-                        rest = 'Orcs in Space!'
-                    elif rest == 'Savage Wizard, Interview with Lesly Julien and Brian Flint':
-                        rest = 'Savage Wizard'
-                    elif rest == 'The O.Z. - Interview with David Pepose':
-                        rest = 'The O.Z. #1-2'
-                    elif rest == '“Everyone Is Tulip” Interview with Dave Baker and Nicole Goux':
-                        rest = 'Everyone Is Tulip'
-                    elif rest == 'Interview with David Pepose, writer for Spencer and Locke':
-                        rest = 'Spencer and Locke'
-                        
-                # save timestamp and label to dictionary
-                timestamps[rest] =  {'segment': 'Timestamps',
-                                     'timestamp': clean_stamp,
-                                     'direct_url':f'{url}?t={timestamp}'}
-     
-    # if we haven't found timestamps
-    if len(timestamps) == 0:
+            for text, is_leaf in item.items:
+                stamps += lex_stamps(text)[0]
 
+    # otherwise, plain-text lines from 00:00:00 on, until a stop (comic headers end the timestamps)
+    if len(stamps) == 0:
         record = False
 
-        for line in soup.text.split('\n'):
-            
-            if '00:00:00' in line:
-                record = True
-                
-            check = re.search(heads+'|infinity shred', line.lower())
-
-            if check:
-                record = False
-
-            if record:
-                # clean fake bullets
-                try:
-                    if line.strip()[0] == '*':
-                        line = line[1:].strip().strip('*').strip()
-                except:
-                    pass
-                
-                # make all dashes the same character
-                stamp_text = line.replace('–', '-')
-                split_stamp = [item.strip() for item in stamp_text.split('-')]
+        for line in summary.lines:
+            found, record = lex_stamps(line, stops, record)
+            stamps += found
 
-                try:
-                    time = [val for val in split_stamp if val[0].isdigit()][0]
-                    h,m,s = time.split(':')
+    timestamps = dict()
 
-                    text = [val for val in split_stamp if not val[0].isdigit()][0]
+    for stamp in stamps:
+        h, m, s = ('00:' + stamp.time).split(':')[-3:]
 
-                    timestamps[text] = {'segment': 'Timestamps',
-                                         'timestamp': time,
-                                         'direct_url':f'{url}?t={h}h{m}m{s}s'}
+        # segment labels that stand for a comic (comic_aliases.json)
+        label = labels.get(stamp.label, stamp.label)
+
+        timestamps[label] = Timestamp('Timestamps', stamp.time, f'{url}?t={h}h{m}m{s}s')
 
-                except:
-                    pass
-                    # print(f'Skipping: {line}, {url}')
-                
     return timestamps
 
 
-def get_bullets(soup):
-    # extract text from bulleted list for a given episdoe
+def get_bullets(summary):
+    # extract text from bulleted list for a given episdoe (episode_html.Summary)
     bulletted = dict()
     heads = get_comic_heads() # search string for comic headers
 
     
-    for p in soup.find_all('p'):
-        bullets = p.find_next('ul')
-        
-        try:
-            for bullet in bullets.find_all('li'):
-
-                # only keep sub-bullets
-                if len(bullet.find_all('li')) == 0:
-                    bulletted[bullet.text] = p.text # segment name
-        except:
-            pass
+    for p in summary.paragraphs:
+        # no list after this paragraph
+        if p.next_list is None:
+            continue
+
+        bullets = summary.lists[p.next_list]
+
+        for bullet, is_leaf in bullets.items:
+
+            # only keep sub-bullets
+            if is_leaf:
+                bulletted[bullet] = p.text # segment name
         
     # if we haven't found bullets yet
     if len(bulletted) == 0:
         segment = ''
         
-        for line in soup.text.split('\n'):
+        for line in summary.lines:
             if '*' in line.lower():
                 text = line.split('*')
 
@@ -239,25 +245,29 @@ def get_bullets(soup):
     comics = dict()
     
     for comic, segment in bulletted.items():
-        check = re.search(heads, segment.lower())
+        check = heads.search(segment)
         if check:
             comics[comic] = segment
                     
     return comics
 
-def get_ents(summary_raw):
-    # get entities (specifically WORK_OF_ART) from a given episode
-
-    art = set()
+def get_ents_text(summary_raw):
+    # text to search for entities in a given episode
     
     # cut off credits in searching for entities
     summary_raw = summary_raw[:summary_raw.find('Patreon')]
     
-    # adjust nicknames
-    summary_raw = summary_raw.replace('Wic+Div', 'The Wicked + The Divine')
-    
-    # convert to spacy doc
-    doc = nlp(summary_raw)
+    # adjust nicknames (comic_aliases.json)
+    for alias, title in comic_index.get_aliases()['text'].items():
+        summary_raw = summary_raw.replace(alias, title)
+
+    return summary_raw
+
+
+def get_ents(doc):
+    # get entities (specifically WORK_OF_ART) from a given episode
+
+    art = set()
     
     for ent in doc.ents:
         if ent.label_ == 'WORK_OF_ART':
@@ -268,37 +278,32 @@ def get_ents(summary_raw):
 
 def match_segments(comics, art, timestamps, base_url):
     # match items extracted from timestamps, bulleted lists, and named entities
+    # similarities for each step are computed in one batch (see fuzzy.py)
           
     ###### From bullets: Items without a timestamp
     timestamp_keys = dict((seg.lower(), seg) for seg in timestamps.keys()) 
 
-    # check if this segment matches a timestamp
-    max_sim = 0
-    assign = ''
+    # check which timestamp each bullet's segment matches best
+    bullets = list(comics.keys())
+    best = fuzzy.best_match([comics[comic].lower() for comic in bullets],
+                            list(timestamp_keys.keys()))
+    labels = list(timestamp_keys.values())
 
     matched = dict() # comics matched to timestamps
-    for comic, segment in comics.items():
-        seg = segment.lower()
+    for comic, (i, sim) in zip(bullets, best):
+        if i is not None:
+            matched[comic] = labels[i]
 
-        for key in timestamp_keys:
-            sim = jaro_winkler_similarity(seg, key)
-
-            if sim > max_sim:
-                assign = timestamp_keys[key]
-                max_sim = sim
-
-            matched[comic] = assign
+    # check if each segment is just the comic name
+    sims = fuzzy.similarity_pairs(matched.keys(), matched.values())
 
     # copy comics and timestamp comics over to final 'all_comics' dict
     all_comics = dict()
     skip = set() # timestamps we don't need any more
         
-    for comic, segment in matched.items():
-        stamp = timestamps[segment]['timestamp']
-        url = timestamps[segment]['direct_url']
-
-        # check if the segment is just the comic name
-        sim = jaro_winkler_similarity(comic, segment)
+    for (comic, segment), sim in zip(matched.items(), sims):
+        stamp = timestamps[segment].timestamp
+        url = timestamps[segment].direct_url
 
         # if this segment is just the comic name
         if sim > .85:
@@ -306,10 +311,7 @@ def match_segments(comics, art, timestamps, base_url):
             segment = 'Timestamps'
             
 
-        all_comics[comic] = {'segment': segment,
-                             'timestamp': stamp,
-                             'direct_url': url,
-        }
+        all_comics[comic] = Timestamp(segment, stamp, url)
             
     # add timestamps that weren't matched
     non = get_non_comic_tags()
@@ -317,7 +319,7 @@ def match_segments(comics, art, timestamps, base_url):
     for label, info in timestamps.items():
         if label not in skip:
             # check if we think this text is a comic
-            check = re.search(non, label.lower())
+            check = non.search(label)
 
             # only save if text does not match a non-comic string
             if not check:
@@ -326,83 +328,141 @@ def match_segments(comics, art, timestamps, base_url):
 
     # check if we need to add any addtional work_of_art
     if art:
-        compare = set(all_comics.keys())
+        art = list(art)
+        compare = list(all_comics.keys())
+
+        # check if we've already found this art in all_comics
+        sims = fuzzy.similarity_matrix([item.lower() for item in art],
+                                       [alt.lower() for alt in compare])
+        found = (sims > .8).any(axis=1)
         
-        for item in art:
-            found = False
-            
-            for alt in compare:
-                sim = jaro_winkler_similarity(item.lower(), alt.lower())
-                
-                # check if we've already found this art in all_comics
-                if sim > .8:
-                    found = True
-                    
-            if not found:
-                check = re.search(non, item.lower())
+        for item, already in zip(art, found):
+            if not already:
+                check = non.search(item)
 
                 # only save if text does not match a non-comic string
                 if not check:
-                    all_comics[item] = {'segment': 'Other',
-                                        'timestamp': '00:00:00',
-                                         'direct_url': base_url
-                                       }
+                    all_comics[item] = Timestamp('Other', '00:00:00', base_url)
                 
         
     return all_comics   
 
 
-def parse_episodes(rss, episodes):
+def get_summary_raw(details):
+    # description HTML of an entry, format changes pre/post old_format_start
+    if episode_store.get_published(details) > old_format_start and 'content' in details:
+        # new
+        return details['content'][0]['value']
+
+    # old, or entries from other feeds with only a summary
+    return details['summary']
+
+
+def extract_html(summary_raw, url):
+    # non-NLP extraction for one episode, safe to run in a worker process
+
+    # parsed once, shared with get_episodes when run in the same process
+    summary = episode_html.parse_summary(summary_raw)
+    
+    #### get timestamped items
+    try:
+        timestamps = get_timestamps(summary, url)
+    except:
+        timestamps = dict()
+        
+    #### get comics from bulletted lists
+    try:
+        comics = get_bullets(summary)
+    except:
+        comics = dict()
+
+    return timestamps, comics
+
+
+def _map(pool, func, *iterables):
+    # map in the process pool if we have one, results in input order
+    if pool is None:
+        return list(map(func, *iterables))
+
+    return list(pool.map(func, *iterables, chunksize=chunk_size))
+
+
+def parse_episodes(rss, episodes, workers=None):
+    '''
+    Comics mentioned in each episode
+
+    HTML extraction and matching run in a pool of worker processes when
+    workers > 1. NER runs in this process, batched over all episodes.
+
+    Comic titles are mapped onto known titles (see comic_index) unless
+    canonical_titles is off.
+
+    Input: JSON of RSS feed ({show_id: entry}), dataframe with episode titles
+    Output: list of ComicMention, in the same order as rss
+    '''
+
+    if workers is None:
+        workers = pool_workers
+
     rows = list()
 
-    for i, details in rss.items():
-        # from previously parsed table
-        row = episodes.loc[int(i)][['title', 'show_id']].to_list()
+    # titles from previously parsed table, joined on show_id
+    titles = dict(zip(episodes['show_id'].astype(str), episodes['title']))
+
+    meta = list()
+    summaries = list()
+    urls = list()
+
+    for details in rss.values():
+        show_id = episode_store.get_show_id(details)
         
         # base url, timestamp will be added to this
         url = details['links'][0]['href']
         
-        # format changes pre/post old_format_start
-        date = datetime.strptime(details['published'], '%a, %d %b %Y %H:%M:%S %z').date()
-        
-        if date > old_format_start:
-            # new
-            summary_raw = details['content'][0]['value']
-        else:
-            # old
-            summary_raw = details['summary']
-        
-        # extract summary as html
-        soup = BeautifulSoup(summary_raw, features='html.parser')
-        
-        #### get timestamped items
-        try:
-            timestamps = get_timestamps(soup, url)
-        except:
-            timestamps = dict()
-            
-        #### get comics from bulletted lists
-        try:
-            comics = get_bullets(soup)
-        except:
-            comics = dict()
+        summary_raw = get_summary_raw(details)
+
+        meta.append((titles[show_id], show_id))
+        summaries.append(summary_raw)
+        urls.append(url)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    try:
+        # timestamps and bulleted lists
+        with instrument.stage('comic_html'):
+            extracted = _map(pool, extract_html, summaries, urls)
+
+        # get named entities from title + summary, all episodes at once
+        texts = [get_ents_text(title + ' ' + summary_raw) for (title, show_id), summary_raw in zip(meta, summaries)]
+        docs = ner.pipe_docs(texts, disable=ner_disable)
 
-        # get named entities from title + summary        
-        art = get_ents(row[0] + ' ' + summary_raw)
+        art = [get_ents(doc) for doc in docs]
 
         # merge all sources into one list of comics
-        all_comics = match_segments(comics, art, timestamps, url)
+        with instrument.stage('comic_match'):
+            merged = _map(pool,
+                          match_segments,
+                          [comics for timestamps, comics in extracted],
+                          art,
+                          [timestamps for timestamps, comics in extracted],
+                          urls)
 
-        # create unique row for each comic
-        for comic, deets in all_comics.items():
-            this_row = row.copy()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    for (title, show_id), all_comics in zip(meta, merged):
 
-            this_row.append(comic)
+        # create unique row for each comic
+        for comic, stamp in all_comics.items():
+            rows.append(ComicMention(title, show_id, comic, *stamp))
 
-            for k, v in deets.items():
-                this_row.append(v)
+    # same title spelled the same way across episodes
+    if canonical_titles:
+        with instrument.stage('comic_titles'):
+            rows = comic_index.canonical_rows(rows)
 
-            rows.append(this_row)
+    instrument.count('comics_emitted', len(rows))
 
     return rows
    
@@ -411,11 +471,17 @@ def parse_episodes(rss, episodes):
 
 def main():
     # raw rss data
-    with open('public_feed.json', 'r') as fp:
-        rss = json.loads(fp.read())
+    with instrument.stage('store_load'):
+        rss = episode_store.load()
+
+    instrument.count('episodes_seen', len(rss))
     
-    # Table of previously parsed episode data
-    episodes = pd.read_excel('tables/public_feed_episodes.xlsx')
+    # Table of previously parsed episode data, for the titles
+    episodes = table_store.read_episodes(['show_id', 'title'])
+
+    # episodes that are not in the tables yet have no title to go by
+    known = set(episodes['show_id'].dropna().astype(str))
+    rss = dict((show_id, details) for show_id, details in rss.items() if show_id in known)
 
     print(f'Extracting comics from {len(rss)} episodes...')
 
@@ -425,19 +491,22 @@ def main():
 
 
     # save to dataframe
-    header = ['episode_title',
-              'show_id',
-              'comic', 
-              'segment',
-              'timestamp',
-              'direct_url']
+    df = to_frame(rows, ComicMention)
+
+    # replaces the comics of these episodes
+    table_store.upsert(comics=df)
+
+    # keep the title and full-text indexes in step, as update_tables does
+    with instrument.stage('index_titles'):
+        comic_index.add_titles(df['comic'])
 
-    df = pd.DataFrame(rows, columns=header)
+    with instrument.stage('search_index'):
+        search_index.add(rss.keys())
 
-    df.to_excel('tables/public_feed_comics.xlsx', 
-               index=False)
+    table_store.export()
 
 
 if __name__ == "__main__":
-  main()
+  with instrument.run('get_comics'):
+    main()
 
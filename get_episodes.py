@@ -1,81 +1,100 @@
-import json
 import re
 import pandas as pd
-from bs4 import BeautifulSoup
+from datetime import datetime
+from typing import NamedTuple
+
+# custom scripts
+import episode_html
+import episode_store
+import instrument
+import ner
+import table_store
+from records import Episode, to_frame
 
 
 #### set up text matching
-import spacy
-from spacy.matcher import Matcher
-from spacy.language import Language
-from spacy.tokens.span import Span
-
-nlp = spacy.load('en_core_web_trf')
-matcher = Matcher(nlp.vocab)
-
-@Language.component('no_possesive')
-def no_possesive(doc):
-    doc.ents = _no_possesive_generator(doc)
-    return doc
-
-def _no_possesive_generator(doc):
-    """Yields non possessive versions of the given document's entities."""
-    for ent in doc.ents:
-        if ent.text.endswith("'s") or ent.text.endswith("’s"):  # Jean Grey's
-            yield Span(doc, ent.start, ent.end-2, label=ent.label)
-        elif ent.text.endswith("s'") or ent.text.endswith("’s"): # Cyclops'
-            yield Span(doc, ent.start, ent.end-1, label=ent.label)
-        else:
-            yield ent
-            
-nlp.add_pipe('no_possesive')
-
-def init_matcher():
-    # for credits
-    matcher.add("Executive Producer", [[{"LOWER": 'executive'},
-                                        {"LOWER": 'producer'}]
-                            ])
-
-    matcher.add("Producer", [[{"LOWER": 'producer'}],
-                             [{"LOWER": 'produced'}]
-                            ])
-    matcher.add("Prooflistener", [[{"LOWER": 'prooflistener'}]])
-    matcher.add("Editor", [[{"LOWER": 'editor'}],
-                           [{"LOWER": 'edited'}]
-                          ])
-    
-    return
+crew_patterns = {'Executive Producer': [[{"LOWER": 'executive'}, {"LOWER": 'producer'}]],
+                 'Producer': [[{"LOWER": 'producer'}], [{"LOWER": 'produced'}]],
+                 'Prooflistener': [[{"LOWER": 'prooflistener'}]],
+                 'Editor': [[{"LOWER": 'editor'}], [{"LOWER": 'edited'}]]}
+# credit roles, matched on lowercase tokens
+
+_matchers = dict()
+# compiled credit matchers, one per vocab (see get_matcher)
+
+ner_disable = ['tagger', 'attribute_ruler', 'lemmatizer']
+# people / crew extraction only needs sentences and entities
+
+content_format_start = datetime(2018, 3, 28).date()
+# episodes up to March 28, 2018 keep their description in 'summary',
+# later episodes in 'content'
+
+
+def get_matcher(vocab):
+    '''
+    Credit matcher for docs with this vocab, compiled on first use
+
+    Output: Matcher, dict of {match_id: role}
+    '''
+
+    if id(vocab) not in _matchers:
+        from spacy.matcher import Matcher
+
+        matcher = Matcher(vocab)
+
+        for role, patterns in crew_patterns.items():
+            matcher.add(role, patterns)
+
+        roles = dict((vocab.strings[role], role) for role in crew_patterns)
+
+        # keep the vocab, so its id is not reused
+        _matchers[id(vocab)] = (vocab, matcher, roles)
+
+    vocab, matcher, roles = _matchers[id(vocab)]
+
+    return matcher, roles
+
+
+class Credits(NamedTuple):
+    # people and crew roles of one episode, names comma-separated
+    people: str
+    executive_producer: str
+    producer: str
+    editor: str
+    prooflistener: str
+
+
+def get_authors(details):
+    # credited authors, '' for entries without any (eg, from other feeds)
+    try:
+        return details['authors'][0]['name']
+    except (KeyError, IndexError):
+        return ''
 
 
 def parse_episodes(rss):
     ''' 
     Inital parse
 
-    Extract data from each episode. Save as list of row data for dataframe
+    Extract data from each episode. Save as list of records for dataframe
 
-    Input: JSON of RSS feedt
-    Output: list of rows
+    Input: JSON of RSS feedt ({show_id: entry})
+    Output: list of Episode
     '''
 
     
     rows = list()
 
-    for i, details in rss.items():
-        row = list()
-
+    for details in rss.values():
         #### easy meta data
         title = details['title']
-        subtitle = details['subtitle']
+        subtitle = details.get('subtitle', '')
         url = details['links'][0]['href']
         date = details['published']
-        authors = details['authors'][0]['name']
+        authors = get_authors(details)
         
         # show id
-        show_id = details['id']
-
-        # if the show_id is a url, just keep the number
-        if 'ircb' in show_id:
-            show_id = show_id.split('?p=')[-1]
+        show_id = episode_store.get_show_id(details)
 
         # create single str from keyword list
         try:
@@ -86,23 +105,26 @@ def parse_episodes(rss):
 
 
         ##### clean summary text
+        published = episode_store.get_published(details)
 
-        ## new episodes
-        if int(i) < 460:
+        ## new episodes (entries from other feeds may only have a summary)
+        if published > content_format_start and 'content' in details:
             summary_raw = details['content'][0]['value']
             
         # older episodes    
-        elif int(i) >= 460:
+        else:
             summary_raw = details['summary']
 
         # if we have html, clean each paragraph
         if '<p>' in summary_raw:
             summary = ''
-            soup = BeautifulSoup(summary_raw, features='html.parser')
+
+            # parsed once, shared with get_comics
+            parsed = episode_html.parse_summary(summary_raw)
 
             # remove weird space characters that pop up sometimes
-            for item in soup.find_all('p'):
-                raw = item.get_text(separator=' ')
+            for item in parsed.paragraphs:
+                raw = item.spaced
                 words = [re.sub(r'\s', ' ', word) for word in raw.split()]
                 
                 # replace line breaks, etc with just a space
@@ -148,14 +170,17 @@ def parse_episodes(rss):
             # if all else fails, estimate a value
             episode_num = 496
 
-        # create row of data for this episode
-        row = [title, subtitle, has_timestamps,
-               date, 
-               authors, keywords, url,
-               episode_num, 
-               summary, show_id]
-
-        rows.append(row)
+        # create record for this episode
+        rows.append(Episode(title=title,
+                            subtitle=subtitle,
+                            has_timestamps=has_timestamps,
+                            date=date,
+                            authors=authors,
+                            keywords=keywords,
+                            simplecast_url=url,
+                            episode_number=episode_num,
+                            full_summary=summary,
+                            show_id=show_id))
         
     return rows
 
@@ -163,43 +188,14 @@ def initial_parse(rss):
     # extract data
     rows = parse_episodes(rss)
     
-    # table header
-    header = ['title',
-              'subtitle',
-              'has_timestamps',
-              'date', 
-              'authors',
-              'keywords',
-              'simplecast_url', 
-              'episode_number', 
-              'full_summary', 
-              'show_id']
-    
-    # turn to dataframe
-    df = pd.DataFrame(rows, columns=header)
+    # turn to dataframe, one column per Episode field
+    df = to_frame(rows, Episode)
     
     print(f'Initial parse completed.')
 
     return df
 
 #### Functions for extracting names from summary
-def get_count(df, col):
-    
-    # count times name appears in col
-    counts = dict()
-
-    for i, name_list in df[col].items():
-        # only if we have text to parse
-        if isinstance(name_list, str):
-            for n in name_list.split(','):
-                name = n.strip()
-
-                counts.setdefault(name, 0)
-                counts[name] += 1
-            
-    return counts
-
-
 def get_people(x, full):
     '''
     Extract host names from summary
@@ -254,62 +250,88 @@ def get_people(x, full):
     return ', '.join(people_sorted)
 
 
-def get_crew(x):
-    crew = dict()
-    
-    # look for matches
-    matches = matcher(x)
-    
-    # save spans for each match
-    spans = dict()
-
-    for match_id, start, end in matches:
-        role = nlp.vocab.strings[match_id] # title of pattern
-        found = True
+class Extractor:
+    '''
+    People and crew roles from a spacy doc
 
-        # only keep 'producer' span if not exec producer
-        if role == 'Producer':
-            if 'Executive Producer' in spans.keys():
-                ep_end = spans['Executive Producer'][1]
+    Credit matchers are compiled once per vocab and shared by every
+    extractor, so building one per run is cheap.
 
-                if end <= ep_end:
-                    found = False
+    Input: dict of first_name : full_name, for one-word names
+    '''
 
-        if found:
-            spans[role] = [start, end]
-    
-    # ensure spans are in order of text
-    spans = dict(sorted(spans.items(), key=lambda item: item[1]))
-    
-    # search for names between role spans
-    search = dict()
-    old_role = ''
+    def __init__(self, full):
+        self.full = full
 
-    for role, (start, end) in spans.items():
+    def __call__(self, doc):
+        # Credits for one doc
+        crew = self.get_crew(doc)
 
-        # search for the name in this role after role span ends
-        search.setdefault(role, list())
-        search[role].append(end)
+        return Credits(get_people(doc, self.full),
+                       ', '.join(crew.get('Executive Producer', [])),
+                       ', '.join(crew.get('Producer', [])),
+                       ', '.join(crew.get('Editor', [])),
+                       ', '.join(crew.get('Prooflistener', [])))
 
-        # if we have an old role, end the last search
-        if old_role != '':
-            search[old_role].append(start)
+    def get_crew(self, x):
+        crew = dict()
 
-        # save old_rold
-        old_role = role
+        # docs may come from the cache, match on the doc's own vocab
+        matcher, roles = get_matcher(x.vocab)
         
-    # extract names
-    for role, span in search.items():
-        crew.setdefault(role, list())
+        # look for matches
+        matches = matcher(x)
         
-        if len(span) < 2:
-            span.append(-1) # end of string
+        # save spans for each match
+        spans = dict()
+
+        for match_id, start, end in matches:
+            role = roles[match_id] # title of pattern
+            found = True
 
-        for ent in x[span[0]:span[1]].ents:
-            if ent.label_=='PERSON':
-                crew[role].append(ent.text)        
+            # only keep 'producer' span if not exec producer
+            if role == 'Producer':
+                if 'Executive Producer' in spans.keys():
+                    ep_end = spans['Executive Producer'][1]
+
+                    if end <= ep_end:
+                        found = False
+
+            if found:
+                spans[role] = [start, end]
+        
+        # ensure spans are in order of text
+        spans = dict(sorted(spans.items(), key=lambda item: item[1]))
         
-    return crew
+        # search for names between role spans
+        search = dict()
+        old_role = ''
+
+        for role, (start, end) in spans.items():
+
+            # search for the name in this role after role span ends
+            search.setdefault(role, list())
+            search[role].append(end)
+
+            # if we have an old role, end the last search
+            if old_role != '':
+                search[old_role].append(start)
+
+            # save old_rold
+            old_role = role
+            
+        # extract names
+        for role, span in search.items():
+            crew.setdefault(role, list())
+            
+            if len(span) < 2:
+                span.append(-1) # end of string
+
+            for ent in x[span[0]:span[1]].ents:
+                if ent.label_=='PERSON':
+                    crew[role].append(ent.text)        
+            
+        return crew
 
 
 def merge_producers(ep, prod):
@@ -325,107 +347,95 @@ def merge_producers(ep, prod):
         
     return producers
 
-def parse_crew(df):
-    df['crew'] = df['doc'].apply(lambda x: get_crew(x))
-    
-    # get producer lists
-    ep = df['crew'].apply(lambda x: ', '.join(x['Executive Producer']) if 'Executive Producer' in x.keys() else '')
-    prod = df['crew'].apply(lambda x: ', '.join(x['Producer']) if 'Producer' in x.keys() else '')
-    
-    # merge producer lists
-    df['producer'] = merge_producers(ep, prod)
-    
-    df['editor'] = df['crew'].apply(lambda x: ', '.join(x['Editor']) if 'Editor' in x.keys() else '')
-    df['prooflistener'] = df['crew'].apply(lambda x: ', '.join(x['Prooflistener']) if 'Prooflistener' in x.keys() else '')
-    
+
+def credit_columns(records, index=None):
+    '''
+    Episode table columns from Credits
+
+    Output: dataframe with people, producer (executive producers merged in),
+    editor and prooflistener
+    '''
+
+    df = pd.DataFrame(records, columns=Credits._fields, index=index)
+    df['producer'] = merge_producers(df['executive_producer'], df['producer'])
+
+    return df[['people', 'producer', 'editor', 'prooflistener']]
+
+
+def add_credits(df, extractor):
+    # people and crew columns from df['doc'], one extractor pass per doc
+    credits = credit_columns([extractor(doc) for doc in df['doc']], df.index)
+
+    for col in credits.columns:
+        df[col] = credits[col]
+
     # updates dataframe in place, do not need to return anything
     return 
-    
-def get_names(episodes):
-    counts = get_count(episodes, 'people')
-    
-    # create dict of first_name : full_name
-    full = dict()
-
-    for name_list in episodes['people']:
-        # only if we have text to parse
-        if isinstance(name_list, str):
-            for n in name_list.split(','):
-                name = n.strip()
-
-                if counts[name] > 2:
-                    names = name.split()
-                    full[names[0]] = name
-                
-    return full
 
     
-def update(new, old):
-    full = get_names(old)
+def update(new):
+    # regulars registry, with the new episodes counted
+    full = get_regulars(new)
     
     # for parsing a df of new episodes
-    new['doc'] = [nlp(doc) for doc in new['full_summary']]
-    
-    # inialize matching search
-    init_matcher()
+    new['doc'] = ner.pipe_docs(new['full_summary'], disable=ner_disable)
 
     # extract people and crew roles from text
-    new['people'] = new['doc'].apply(lambda x: get_people(x, full))
-    new['crew'] = new['doc'].apply(lambda x: get_crew(x))
-    parse_crew(new)
+    with instrument.stage('people_crew'):
+        add_credits(new, Extractor(full))
 
-    return new[old.columns]
+    return new[table_store.episode_columns]
     
 
-def main():
-    # load rss data
-    with open('public_feed.json', 'r') as fp:
-        rss = json.loads(fp.read())
-    
-    print(f'{len(rss)} episodes pulled from RSS feed')
-    
-    # inital parse of data
-    episodes = initial_parse(rss)
+def get_regulars(episodes=None, path=table_store.db_file, store=episode_store.store_file):
+    '''
+    Names of show regulars, from the registry in table_store
+
+    Authors of episodes are counted first (episodes counted before are
+    skipped). A new registry starts from the authors of every episode in
+    the episode store.
 
-    # Get names of regulars
-    counts = get_count(episodes, 'authors')
+    Input: dataframe with show_id and authors (from initial_parse), or None;
+    table store and episode store paths
+    Output: dict of first_name : full_name
+    '''
 
-    # create dict of first_name : full_name
-    full = dict()
+    if table_store.count('regular_episodes', path) == 0:
+        table_store.add_regulars(((show_id, get_authors(entry))
+                                  for show_id, entry in episode_store.iterate(path=store)), path)
 
-    for name_list in episodes['authors']:
-        for n in name_list.split(','):
-            name = n.strip()
-            
-            if counts[name] > 2:
-                names = name.split()
+    if episodes is not None:
+        table_store.add_regulars(zip(episodes['show_id'].astype(str), episodes['authors']), path)
 
-                full[names[0]] = name
-            
-    # Rene Rodriguez --> René Rodriguez
-    full['Rene'] = 'René Rodriguez'
+    return table_store.read_regulars(path)
+
+
+def extract(episodes, full):
+    '''
+    Full parse: people and crew roles for every episode
 
-    # inialize matching search
-    init_matcher()
+    Input: dataframe from initial_parse, dict of first_name : full_name
+    Output: dataframe with the columns of the episode table
+    '''
 
     # convert raw text to spacy object
     print('Creating Spacy documents')
-    episodes['doc'] = [nlp(doc) for doc in episodes['full_summary']]
+    episodes['doc'] = ner.pipe_docs(episodes['full_summary'], disable=ner_disable)
+
+    extractor = Extractor(full)
 
     # extract people and crew roles from text
-    episodes['people'] = episodes['doc'].apply(lambda x: get_people(x, full))
-    episodes['crew'] = episodes['doc'].apply(lambda x: get_crew(x))
-    parse_crew(episodes)
+    with instrument.stage('people_crew'):
+        add_credits(episodes, extractor)
 
     #### missing people
     # some older episodes name people in subtitle, not in summary
     sub = episodes[episodes['people']==''].copy()
 
-    sub['doc'] = [nlp(doc) for doc in sub['subtitle']]
-    sub['people'] = sub['doc'].apply(lambda x: get_people(x, full))
+    sub['doc'] = ner.pipe_docs(sub['subtitle'], disable=ner_disable)
 
-    # get crew 
-    parse_crew(sub)
+    with instrument.stage('people_crew'):
+        add_credits(sub, extractor)
 
 
     # replace episode values with sub values
@@ -436,26 +446,42 @@ def main():
         episodes.loc[i, 'prooflistener'] = row['prooflistener']
 
     # fix typo
-    for i in np.where(episodes['producer']=='Mike RapinEditor, Zander Riggs')[0]:
-        episodes.loc[i, 'producer'] = 'Mike Rapin'
-        episodes.loc[i, 'editor'] = 'Zander Riggs'
+    typo = episodes['producer']=='Mike RapinEditor, Zander Riggs'
+    episodes.loc[typo, 'producer'] = 'Mike Rapin'
+    episodes.loc[typo, 'editor'] = 'Zander Riggs'
       
 
-    # save to file for manual review
-    cols = ['title', 'subtitle', 'has_timestamps', 'date', 'people', 'keywords',
-            'simplecast_url', 'producer', 'prooflistener', 'editor', 
-            'episode_number', 'full_summary', 'show_id']
+    # columns of the episode table
+    return episodes[table_store.episode_columns]
+
+
+def main():
+    # load rss data
+    with instrument.stage('store_load'):
+        rss = episode_store.load()
+
+    instrument.count('episodes_seen', len(rss))
+    
+    print(f'{len(rss)} episodes pulled from RSS feed')
+    
+    # inital parse of data
+    with instrument.stage('initial_parse'):
+        episodes = initial_parse(rss)
+
+    full = get_regulars(episodes)
 
-    episodes = episodes[cols]
+    episodes = extract(episodes, full)
 
 
     # save to excel because otherwise excel gets snipy about character encoding
-    episodes .to_excel('tables/public_feed_episodes.xlsx', 
-           index=False)
+    with instrument.stage('export'):
+        episodes .to_excel('tables/public_feed_episodes.xlsx', 
+               index=False)
     
     print(f'Data from {len(episodes)} episodes extracted and saved to file')
 
     
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with instrument.run('get_episodes'):
+        main()
\ No newline at end of file
@@ -1,40 +1,56 @@
 import feedparser
-import json
+
+# custom scripts
+import episode_store
+import feeds
+import instrument
+
+### global variables ###
+rss_url = 'https://feeds.simplecast.com/U93zjuSN'
+# public feed, also listed in feeds.json
+
+
+def sync():
+    '''
+    Incremental download of every feed in feeds.json (see feeds.py)
+
+    Output: dict of new or changed entries {show_id: entry}
+    '''
+
+    return feeds.sync()
+
 
 def update():
     # download new data
     main()
-    
+
     # load new data
-    with open('public_feed.json', 'r') as fp:
-        rss = json.loads(fp.read())
-        
-    return rss
+    return episode_store.load()
 
 def main():
-    
+
     # retrieve data from RSS feed
-    rss_url = 'https://feeds.simplecast.com/U93zjuSN'
-    feed = feedparser.parse(rss_url)
-    
-    # save entries as dictionary
-    entries = dict()
-    
+    with instrument.stage('feed_download'):
+        feed = feedparser.parse(rss_url)
+
     if feed.status == 200:
-        for i, entry in enumerate(feed.entries):
-            # 0 is newest episode
-            entries[i] = entry
+        print(f'{len(feed.entries)} episodes found')
+        instrument.count('feed_entries', len(feed.entries))
+
+        for entry in feed.entries:
+            entry['feed'] = 'public'
+
+        # 0 is newest episode
+        with instrument.stage('store_write'):
+            changed = episode_store.upsert(feed.entries)
+
+        print(f'{len(changed)} new or changed episodes written to store.')
+        instrument.count('episodes_changed', len(changed))
 
     else:
         print("Failed to get RSS feed. Status code:", feed.status)
 
-    print(f'{len(entries)} episodes found')
 
-    with open('public_feed.json', 'w') as fp:
-        fp.write(json.dumps(entries))
-    
-    print('RSS data written to file.')
-    
-    
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with instrument.run('get_rss'):
+        main()
@@ -0,0 +1,199 @@
+'''
+Run instrumentation
+
+Stage timers, counters and peak memory for one run of the pipeline, saved
+as a JSON run report when the run ends:
+
+    with instrument.run('update'):
+        with instrument.stage('sync'):
+            ...
+        instrument.count('episodes_new', len(new))
+
+Stages may nest (a 'comics' stage includes the 'ner' stage inside it), and a
+stage entered more than once adds up its time and calls. Outside a run,
+stage() and count() do nothing, so library code can call them freely. A run
+started inside another run is just a stage of the outer one.
+
+With profile_dir set (or IRCB_PROFILE_DIR), every outermost stage is also
+run under cProfile and dumped to <profile_dir>/<run>-<stage>.prof, for
+python -m pstats or snakeviz.
+'''
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+### global variables ###
+report_dir = os.environ.get('IRCB_REPORT_DIR', 'reports')
+# run reports are written here, one JSON file per run
+profile_dir = os.environ.get('IRCB_PROFILE_DIR')
+# per-stage cProfile dumps, off if None
+
+_run = None
+# the active run, see start
+
+
+def start(name):
+    global _run
+
+    _run = {'name': name,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'start': time.perf_counter(),
+            'stages': dict(),
+            'counters': dict(),
+            'profiling': False}
+
+
+def active():
+    return _run is not None
+
+
+def count(name, n=1):
+    # add n to a counter of the active run
+    if _run is None:
+        return
+
+    _run['counters'].setdefault(name, 0)
+    _run['counters'][name] += n
+
+
+def get_count(name):
+    # current value of a counter of the active run, 0 if not counted yet
+    if _run is None:
+        return 0
+
+    return _run['counters'].get(name, 0)
+
+
+def peak_memory_mb():
+    # peak resident memory of this process so far
+    try:
+        import resource
+    except ImportError: # not on Windows
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        peak = peak / 1024
+
+    return round(peak / 1024, 1)
+
+
+@contextmanager
+def stage(name):
+    '''
+    Time a stage of the active run
+
+    Profiles the stage if profile_dir is set and no outer stage is already
+    being profiled.
+    '''
+
+    if _run is None:
+        yield
+        return
+
+    info = _run['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0})
+
+    profile = None
+
+    if profile_dir and not _run['profiling']:
+        import cProfile
+
+        profile = cProfile.Profile()
+        _run['profiling'] = True
+        profile.enable()
+
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        info['seconds'] += time.perf_counter() - start
+        info['calls'] += 1
+
+        if profile is not None:
+            profile.disable()
+            _run['profiling'] = False
+
+            os.makedirs(profile_dir, exist_ok=True)
+            profile.dump_stats(os.path.join(profile_dir, f'{_run["name"]}-{name}.prof'))
+
+
+def finish(error=None, save=True):
+    '''
+    End the active run and write its report (unless save is False)
+
+    Output: the report (dict)
+    '''
+
+    global _run
+
+    report = {'run': _run['name'],
+              'started': _run['started'],
+              'seconds': round(time.perf_counter() - _run['start'], 3),
+              'peak_memory_mb': peak_memory_mb(),
+              'stages': dict((name, {'seconds': round(info['seconds'], 3), 'calls': info['calls']})
+                             for name, info in _run['stages'].items()),
+              'counters': _run['counters'],
+              'error': error}
+
+    _run = None
+
+    if report_dir and save:
+        os.makedirs(report_dir, exist_ok=True)
+
+        stamp = report['started'].replace(':', '').replace('-', '')
+        path = os.path.join(report_dir, f'{stamp}-{report["run"]}.json')
+
+        with open(path, 'w') as fp:
+            fp.write(json.dumps(report, indent=2))
+
+        report['path'] = path
+
+    print_report(report)
+
+    return report
+
+
+def print_report(report):
+    print()
+    print(f'Run {report["run"]}: {report["seconds"]:.1f}s, peak memory {report["peak_memory_mb"]} MB')
+
+    for name, info in report['stages'].items():
+        print(f'  {name:<20}{info["seconds"]:>9.2f}s  x{info["calls"]}')
+
+    for name, n in report['counters'].items():
+        print(f'  {name:<20}{n:>9}')
+
+    if 'path' in report:
+        print(f'Report saved to {report["path"]}')
+
+
+@contextmanager
+def run(name):
+    '''
+    Instrument everything inside as one run, report at the end
+
+    Inside another run, this is a stage of that run instead.
+    '''
+
+    if _run is not None:
+        with stage(name):
+            yield
+        return
+
+    start(name)
+
+    try:
+        yield
+
+    except BaseException as e:
+        finish(error=repr(e))
+        raise
+
+    finish()
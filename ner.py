@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+
+# custom scripts
+import doc_cache
+import instrument
+
+### global variables ###
+model_tiers = {'trf': 'en_core_web_trf',
+               'lg': 'en_core_web_lg',
+               'md': 'en_core_web_md',
+               'sm': 'en_core_web_sm'}
+# trf is the most accurate and by far the slowest on CPU
+
+model_tier = os.environ.get('IRCB_MODEL_TIER', 'trf')
+model_name = model_tiers.get(model_tier)
+# None for an unknown tier, which get_model_name reports once a model is needed
+pipe_batch_size = 32
+pipe_n_process = 1
+# nlp.pipe settings shared by every NER call site. n_process > 1 forks
+# worker processes, which only pays off for the smaller (non-transformer) models
+
+use_cache = True
+# read / write parsed docs from doc_cache, only run the model on misses
+
+_models = dict()
+# loaded pipelines, one per model name, shared by every module
+_vocabs = dict()
+# blank vocabs for when every doc comes from the cache
+
+
+def no_possesive(doc):
+    doc.ents = _no_possesive_generator(doc)
+    return doc
+
+def _no_possesive_generator(doc):
+    """Yields non possessive versions of the given document's entities."""
+    from spacy.tokens.span import Span
+
+    for ent in doc.ents:
+        if ent.text.endswith("'s") or ent.text.endswith("’s"):  # Jean Grey's
+            yield Span(doc, ent.start, ent.end-2, label=ent.label)
+        elif ent.text.endswith("s'") or ent.text.endswith("’s"): # Cyclops'
+            yield Span(doc, ent.start, ent.end-1, label=ent.label)
+        else:
+            yield ent
+
+
+def set_tier(tier):
+    # switch every NER call site to another model tier
+    global model_tier, model_name
+    model_tier = tier
+    model_name = model_tiers.get(tier)
+
+    get_model_name()
+
+
+def get_model_name():
+    # spacy package of the current tier
+    if model_name is None:
+        raise ValueError(f'Unknown model tier {model_tier!r} (IRCB_MODEL_TIER), '
+                         f'use one of: {", ".join(model_tiers)}')
+
+    return model_name
+
+
+def get_nlp(name=None):
+    '''
+    Shared spacy pipeline, loaded on first use
+
+    Every caller gets the same instance. Components a caller does not need
+    are switched off per call with pipe_docs(..., disable=...) rather than
+    by loading a second copy of the model.
+    '''
+
+    if name is None:
+        name = get_model_name()
+
+    if name not in _models:
+        import spacy
+        from spacy.language import Language
+
+        if not Language.has_factory('no_possesive'):
+            Language.component('no_possesive', func=no_possesive)
+
+        print(f'Loading {name}')
+
+        with instrument.stage('model_load'):
+            nlp = spacy.load(name)
+            nlp.add_pipe('no_possesive')
+
+        _models[name] = nlp
+
+    return _models[name]
+
+
+def get_vocab(name=None):
+    '''
+    Vocab to load cached docs into
+
+    The loaded model's vocab if there is one, otherwise a blank pipeline's,
+    so reading from the cache never loads the model itself.
+    '''
+
+    if name is None:
+        name = get_model_name()
+
+    if name in _models:
+        return _models[name].vocab
+
+    if name not in _vocabs:
+        import spacy
+
+        _vocabs[name] = spacy.blank(name.split('_')[0]).vocab
+
+    return _vocabs[name]
+
+
+def get_version(name=None):
+    # installed model version, without loading the model
+    from spacy.util import get_package_version
+
+    if name is None:
+        name = get_model_name()
+
+    version = get_package_version(name)
+
+    if version is None:
+        version = 'unknown'
+
+    return version
+
+
+def _pipe(texts, batch_size, n_process, disable):
+    nlp = get_nlp()
+
+    # only skip components this model actually has
+    disable = [name for name in disable if name in nlp.pipe_names]
+
+    start = time.perf_counter()
+
+    docs = list(nlp.pipe(texts,
+                         batch_size=batch_size,
+                         n_process=n_process,
+                         disable=disable))
+
+    elapsed = time.perf_counter() - start
+    instrument.count('ner_model_docs', len(docs))
+
+    if len(docs) > 0:
+        print(f'{len(docs)} documents parsed in {elapsed:.1f}s ({len(docs) / elapsed:.1f} docs/sec)')
+
+    return docs
+
+
+def pipe_docs(texts, batch_size=None, n_process=None, disable=()):
+    '''
+    Batched NER with the shared pipeline
+
+    Docs are read from doc_cache when possible; the model only runs on
+    texts that are not cached yet.
+
+    Input: iterable of texts, names of pipeline components to skip
+    Output: list of spacy docs, same order as texts
+    '''
+
+    if batch_size is None:
+        batch_size = pipe_batch_size
+
+    if n_process is None:
+        n_process = pipe_n_process
+
+    texts = list(texts)
+    instrument.count('ner_docs', len(texts))
+
+    with instrument.stage('ner'):
+        if not use_cache:
+            return _pipe(texts, batch_size, n_process, disable)
+
+        return _pipe_cached(texts, batch_size, n_process, disable)
+
+
+def _pipe_cached(texts, batch_size, n_process, disable):
+    # pipe_docs through doc_cache
+
+    version = get_version()
+    keys = [doc_cache.get_key(text, get_model_name(), version, disable) for text in texts]
+
+    cached = doc_cache.get_many(keys)
+
+    # texts we still need to run the model on
+    todo = dict((key, text) for key, text in zip(keys, texts) if key not in cached)
+
+    print(f'{len(texts) - len(todo)} of {len(texts)} documents found in cache')
+    instrument.count('doc_cache_hits', len(texts) - len(todo))
+    instrument.count('doc_cache_misses', len(todo))
+
+    if len(todo) > 0:
+        docs = _pipe(list(todo.values()), batch_size, n_process, disable)
+
+        new = dict((key, doc_cache.to_bytes(doc)) for key, doc in zip(todo, docs))
+        doc_cache.put_many(new)
+
+        cached.update(new)
+
+    # load every doc into the same vocab
+    vocab = get_vocab()
+
+    return [doc_cache.from_bytes(cached[key], vocab) for key in keys]
+
+
+def compare_throughput(texts, batch_size=None, n_process=None):
+    '''
+    docs/sec of one-at-a-time nlp(doc) calls vs batched nlp.pipe
+    '''
+
+    nlp = get_nlp()
+    texts = list(texts)
+
+    start = time.perf_counter()
+    __ = [nlp(doc) for doc in texts]
+    loop = len(texts) / (time.perf_counter() - start)
+
+    if batch_size is None:
+        batch_size = pipe_batch_size
+
+    if n_process is None:
+        n_process = pipe_n_process
+
+    start = time.perf_counter()
+    __ = _pipe(texts, batch_size, n_process, ())
+    batched = len(texts) / (time.perf_counter() - start)
+
+    print(f'nlp(doc) loop: {loop:.1f} docs/sec')
+    print(f'nlp.pipe:      {batched:.1f} docs/sec ({batched / loop:.1f}x)')
+
+    return {'loop': loop, 'pipe': batched}
+
+
+def main():
+    # compare per-call and batched NER over episode summaries
+    import episode_store
+    import get_episodes
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    rss = episode_store.load()
+    episodes = get_episodes.initial_parse(rss)
+
+    texts = episodes['full_summary'].to_list()[:n]
+
+    compare_throughput(texts)
+
+
+if __name__ == "__main__":
+    with instrument.run('ner'):
+        main()
@@ -0,0 +1,54 @@
+'''
+Typed records passed between the parsers and the tables
+
+Fields are read by name, never by position, and each record is a tuple
+(no per-item __dict__). Lists of records go straight into a dataframe with
+to_frame, with one column per field in field order.
+'''
+
+from typing import NamedTuple
+
+
+class Episode(NamedTuple):
+    # metadata of one episode, before people / crew extraction
+    title: str
+    subtitle: str
+    has_timestamps: int
+    date: str
+    authors: str
+    keywords: str
+    simplecast_url: str
+    episode_number: object # int, or 'Unknown'
+    full_summary: str
+    show_id: str
+
+
+class Timestamp(NamedTuple):
+    # where in an episode a comic (or segment) comes up
+    segment: str
+    timestamp: str # as written in the description, eg 00:12:34
+    direct_url: str # episode url that starts playing at timestamp
+
+
+class Stamp(NamedTuple):
+    # one timestamped label, as lexed from an episode description
+    time: str # as written, eg 00:12:34 or 12:34
+    label: str
+    seconds: int
+
+
+class ComicMention(NamedTuple):
+    # one row of the comics table
+    episode_title: str
+    show_id: str
+    comic: str
+    segment: str
+    timestamp: str
+    direct_url: str
+
+
+def to_frame(records, cls):
+    # dataframe with a column per field of cls, even if records is empty
+    import pandas as pd
+
+    return pd.DataFrame.from_records(records, columns=list(cls._fields))
@@ -0,0 +1,212 @@
+'''
+Full-text search over the episode and comics tables
+
+Answers "which episodes discussed X?" without scanning the xlsx. Two SQLite
+FTS5 tables live next to the tables in table_store.db_file:
+
+  episode_search: one row per episode (rowid = episodes.seq) with its
+                  title, subtitle, full_summary, keywords, people and the
+                  comics mentioned in it
+  comic_search:   one row per comics table row, so a hit can link straight
+                  to the timestamp (direct_url) where a comic comes up
+
+Episodes are ranked by bm25, with title and comic matches weighted above
+matches in the summary (ties, eg words in nearly every episode, go to the
+newest). Text is lowercased, accents removed (Rene matches René) and words
+stemmed (discuss matches discussed).
+
+The index is built from the tables on first use, and update_tables adds or
+replaces the episodes it writes, so it is never rebuilt on an update.
+'''
+
+import re
+import sqlite3
+from typing import NamedTuple
+
+# custom scripts
+import table_store
+
+### global variables ###
+episode_fields = ['title', 'subtitle', 'full_summary', 'keywords', 'people', 'comics']
+# indexed text of each episode, comics is every comic mentioned in it
+weights = {'title': 10.0, 'subtitle': 5.0, 'full_summary': 1.0,
+           'keywords': 3.0, 'people': 3.0, 'comics': 5.0}
+# bm25 weight of a match in each field
+max_mentions = 5
+# timestamp links returned per episode
+
+tokenizer = "porter unicode61 remove_diacritics 2"
+
+schema = [
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS episode_search USING fts5 (
+            show_id UNINDEXED, {', '.join(episode_fields)},
+            tokenize = "{tokenizer}")''',
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS comic_search USING fts5 (
+            show_id UNINDEXED, comic, segment,
+            timestamp UNINDEXED, direct_url UNINDEXED,
+            tokenize = "{tokenizer}")''',
+]
+
+
+class Mention(NamedTuple):
+    # a matching comics table row of a hit
+    comic: str
+    segment: str
+    timestamp: str
+    direct_url: str
+
+
+class SearchHit(NamedTuple):
+    show_id: str
+    title: str
+    date: str
+    score: float # bm25, lower is better
+    snippet: str # best matching text, matches in [brackets]
+    mentions: list # of Mention, best first
+
+
+def to_query(text):
+    # plain words as an FTS5 query: every word has to match, in any field
+    words = re.findall(r'\w+', text)
+
+    return ' '.join('"' + word + '"' for word in words)
+
+
+class SearchIndex:
+    '''
+    Connection to the full-text index
+
+    Use search() to query and add() to index new or changed episodes. Close
+    when done (or use as a context manager).
+    '''
+
+    def __init__(self, path=table_store.db_file):
+        self.con = table_store.connect(path)
+
+        for statement in schema:
+            self.con.execute(statement)
+
+        indexed, = self.con.execute('SELECT COUNT(*) FROM episode_search').fetchone()
+
+        if indexed == 0:
+            self.build()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.con.close()
+
+    def build(self):
+        # index every episode and comic from scratch
+        with self.con:
+            self.con.execute('DELETE FROM episode_search')
+            self.con.execute('DELETE FROM comic_search')
+
+            self._insert('1')
+
+    def _insert(self, where):
+        # (re)index the episodes matching where (a condition on episodes e)
+        self.con.execute(f'''INSERT INTO episode_search (rowid, show_id, {', '.join(episode_fields)})
+                             SELECT e.seq, e.show_id, e.title, e.subtitle, e.full_summary, e.keywords, e.people,
+                                    (SELECT group_concat(c.comic, ' | ') FROM comics c WHERE c.show_id = e.show_id)
+                             FROM episodes e WHERE {where}''')
+
+        self.con.execute(f'''INSERT INTO comic_search (rowid, show_id, comic, segment, timestamp, direct_url)
+                             SELECT c.seq, c.show_id, c.comic, c.segment, c.timestamp, c.direct_url
+                             FROM comics c JOIN episodes e ON e.show_id = c.show_id WHERE {where}''')
+
+    def add(self, show_ids):
+        '''
+        Index new episodes, or replace the index of changed ones
+
+        Input: show_ids just written to the tables
+        Output: number of episodes indexed
+        '''
+
+        show_ids = set(str(show_id) for show_id in show_ids)
+
+        if len(show_ids) == 0:
+            return 0
+
+        with self.con:
+            self.con.execute('CREATE TEMP TABLE IF NOT EXISTS search_ids (show_id TEXT PRIMARY KEY)')
+            self.con.execute('DELETE FROM search_ids')
+            self.con.executemany('INSERT OR IGNORE INTO search_ids VALUES (?)', [(show_id,) for show_id in show_ids])
+
+            self.con.execute('''DELETE FROM episode_search WHERE rowid IN
+                                    (SELECT seq FROM episodes WHERE show_id IN (SELECT show_id FROM search_ids))''')
+            self.con.execute('DELETE FROM comic_search WHERE show_id IN (SELECT show_id FROM search_ids)')
+
+            self._insert('e.show_id IN (SELECT show_id FROM search_ids)')
+
+        return len(show_ids)
+
+    def search(self, query, limit=10, raw=False):
+        '''
+        Episodes matching query, best first
+
+        Input: words to look for (or FTS5 query syntax with raw=True)
+        Output: list of SearchHit
+        '''
+
+        if not raw:
+            query = to_query(query)
+
+        if query == '':
+            return list()
+
+        ranking = ', '.join(str(weights[field]) for field in episode_fields)
+
+        rows = self.con.execute(f'''SELECT s.show_id, e.title, e.date, bm25(episode_search, 0, {ranking}) AS score,
+                                           snippet(episode_search, -1, '[', ']', '…', 16)
+                                    FROM episode_search s JOIN episodes e ON e.seq = s.rowid
+                                    WHERE episode_search MATCH ?
+                                    ORDER BY score, e.seq DESC
+                                    LIMIT ?''',
+                                (query, limit)).fetchall()
+
+        hits = list()
+
+        for show_id, title, date, score, snippet in rows:
+            mentions = list()
+
+            if show_id is not None:
+                try:
+                    mentions = self.con.execute('''SELECT comic, segment, timestamp, direct_url FROM comic_search
+                                                   WHERE comic_search MATCH ? AND show_id = ?
+                                                   ORDER BY rank
+                                                   LIMIT ?''',
+                                                (query, show_id, max_mentions)).fetchall()
+
+                # raw queries on episode fields (eg title: ...) have no comics to link
+                except sqlite3.OperationalError:
+                    pass
+
+            hits.append(SearchHit(show_id, title, date, score, snippet, [Mention(*row) for row in mentions]))
+
+        return hits
+
+
+def search(query, limit=10, raw=False, path=table_store.db_file):
+    with SearchIndex(path) as index:
+        return index.search(query, limit, raw)
+
+
+def add(show_ids, path=table_store.db_file):
+    # index episodes newly written to the tables
+    with SearchIndex(path) as index:
+        return index.add(show_ids)
+
+
+def rebuild(path=table_store.db_file):
+    # index the tables from scratch
+    with SearchIndex(path) as index:
+        index.build()
+
+        n, = index.con.execute('SELECT COUNT(*) FROM episode_search').fetchone()
+
+    return n
@@ -0,0 +1,305 @@
+'''
+Local read-only query service over the episode and comics tables
+
+    python cli.py serve [--port 8080]
+
+Serves JSON on localhost, so consumers don't have to download and parse the
+xlsx tables:
+
+    /episodes/<show_id>        one episode, with its comics
+    /episodes?person=Nick White&producer=...&editor=...&prooflistener=...
+             &comic=Saga&from=2020-01-01&to=2020-12-31&limit=50&offset=0
+                               episodes matching every filter, newest first
+    /comics?title=Saga         every mention of a comic, newest first
+    /status                    data version, table sizes and cache use
+
+Names and comic titles match ignoring case and accents (comic titles after
+comic_index.normalize, so 'the walking dead' finds 'The Walking Dead').
+
+The tables are read once into in-memory indexes (by show_id, person, crew
+role, comic title and date), and responses are kept in an LRU cache.
+Before each request the service checks SQLite's data_version: when anything
+else (eg update_tables) has written to the tables since, the indexes are
+rebuilt and the cache is emptied, so answers are never stale.
+'''
+
+import bisect
+import functools
+import json
+import sqlite3
+import threading
+import unicodedata
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+# custom scripts
+import comic_index
+import table_store
+
+### global variables ###
+default_port = 8080
+cache_size = 4096
+# responses kept in the LRU cache, 0 to turn it off
+default_limit = 50
+# episodes per page of /episodes
+
+crew_roles = ['producer', 'editor', 'prooflistener']
+
+
+def fold(name):
+    # lowercase without accents, so 'rene rodriguez' finds René Rodriguez
+    name = unicodedata.normalize('NFKD', name.strip().lower())
+
+    return ''.join(c for c in name if not unicodedata.combining(c))
+
+
+class Tables:
+    '''
+    In-memory copy of the tables, with an index per filter
+
+    Episodes are kept newest first, and every index holds positions in that
+    list, so filters combine by set intersection and sort back to newest
+    first.
+    '''
+
+    def __init__(self, path=table_store.db_file):
+        with closing(table_store.connect(path)) as con:
+            con.row_factory = sqlite3.Row
+
+            self.episodes = [dict(row) for row in
+                             con.execute(f'SELECT {", ".join(table_store.episode_columns)} FROM episodes ORDER BY seq DESC')]
+            self.comics = [dict(row) for row in
+                           con.execute(f'SELECT {", ".join(table_store.comic_columns)} FROM comics ORDER BY seq DESC')]
+
+        self.by_show_id = dict()
+        self.by_person = dict()
+        self.by_role = dict((role, dict()) for role in crew_roles)
+        self.by_comic = dict()
+        # comic norm -> positions in self.comics
+        self.comics_by_show_id = dict()
+        dates = list()
+
+        for i, episode in enumerate(self.episodes):
+            if episode['show_id'] is not None:
+                self.by_show_id[episode['show_id']] = i
+
+            for name in set(map(fold, table_store.split_names(episode['people']))):
+                self.by_person.setdefault(name, list()).append(i)
+
+            for role in crew_roles:
+                for name in set(map(fold, table_store.split_names(episode[role]))):
+                    self.by_role[role].setdefault(name, list()).append(i)
+
+            date = table_store.iso_date(episode['date'])
+
+            if date is not None:
+                dates.append((date, i))
+
+        dates.sort()
+        self.dates = [date for date, i in dates]
+        self.date_positions = [i for date, i in dates]
+
+        for i, comic in enumerate(self.comics):
+            if comic['comic'] is not None:
+                self.by_comic.setdefault(comic_index.normalize(str(comic['comic'])), list()).append(i)
+
+            self.comics_by_show_id.setdefault(comic['show_id'], list()).append(i)
+
+    def between(self, start=None, end=None):
+        # positions of episodes published from start to end (ISO dates, inclusive)
+        lo = 0 if start is None else bisect.bisect_left(self.dates, start)
+        hi = len(self.dates) if end is None else bisect.bisect_right(self.dates, end)
+
+        return self.date_positions[lo:hi]
+
+    def episode(self, show_id):
+        if show_id not in self.by_show_id:
+            return None
+
+        episode = dict(self.episodes[self.by_show_id[show_id]])
+        episode['comics'] = [self.comics[i] for i in self.comics_by_show_id.get(show_id, list())]
+
+        return episode
+
+    def find_episodes(self, person=None, comic=None, start=None, end=None, **crew):
+        '''
+        Episodes matching every filter given, newest first
+
+        Input: person / crew role names, comic title, ISO date range
+        Output: list of episode dicts
+        '''
+
+        matches = list()
+
+        if person is not None:
+            matches.append(self.by_person.get(fold(person), list()))
+
+        for role, name in crew.items():
+            matches.append(self.by_role[role].get(fold(name), list()))
+
+        if comic is not None:
+            show_ids = set(self.comics[i]['show_id'] for i in self.by_comic.get(comic_index.normalize(comic), list()))
+            matches.append([self.by_show_id[show_id] for show_id in show_ids if show_id in self.by_show_id])
+
+        if start is not None or end is not None:
+            matches.append(self.between(start, end))
+
+        if len(matches) == 0:
+            positions = range(len(self.episodes))
+        else:
+            positions = sorted(set(matches[0]).intersection(*matches[1:]))
+
+        return [self.episodes[i] for i in positions]
+
+    def find_comics(self, title):
+        return [self.comics[i] for i in self.by_comic.get(comic_index.normalize(title), list())]
+
+
+class QueryService:
+    '''
+    Tables plus the response cache, reloaded when the database changes
+
+    get(version, target) answers a request target (path and query string)
+    with (HTTP status, encoded JSON body), through the cache. The data
+    version is part of the cache key, so an answer computed from the old
+    tables while they are reloaded is never served afterwards.
+    '''
+
+    def __init__(self, path=table_store.db_file):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # seeds the tables if there are none yet
+        table_store.connect(path).close()
+
+        # only used to notice writes from other connections
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.version = None
+
+        self.get = functools.lru_cache(maxsize=cache_size)(self._get)
+        self.refresh()
+
+    def refresh(self):
+        # reload the tables and empty the cache if anything wrote to the database
+        with self.lock:
+            version, = self.con.execute('PRAGMA data_version').fetchone()
+
+            if version == self.version:
+                return
+
+            self.tables = Tables(self.path)
+            self.get.cache_clear()
+            self.version = version
+
+    def status(self):
+        info = self.get.cache_info()
+
+        return {'data_version': self.version,
+                'episodes': len(self.tables.episodes),
+                'comics': len(self.tables.comics),
+                'cache': {'hits': info.hits, 'misses': info.misses,
+                          'size': info.currsize, 'max_size': info.maxsize}}
+
+    def _get(self, version, target):
+        status, body = self.query(target)
+
+        return status, json.dumps(body, default=str).encode()
+
+    def query(self, target):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = dict(parse_qsl(url.query))
+        tables = self.tables
+
+        if parts == ['episodes']:
+            try:
+                limit = int(query.pop('limit', default_limit))
+                offset = int(query.pop('offset', 0))
+            except ValueError:
+                return 400, {'error': 'limit and offset must be integers'}
+
+            filters = dict((key, query.pop(key)) for key in ['person', 'comic', *crew_roles] if key in query)
+            start = query.pop('from', None)
+            end = query.pop('to', None)
+
+            if query:
+                return 400, {'error': f'unknown parameters: {", ".join(query)}'}
+
+            episodes = tables.find_episodes(start=start, end=end, **filters)
+
+            return 200, {'total': len(episodes), 'episodes': episodes[offset:offset + limit]}
+
+        if len(parts) == 2 and parts[0] == 'episodes':
+            episode = tables.episode(parts[1])
+
+            if episode is None:
+                return 404, {'error': f'no episode {parts[1]}'}
+
+            return 200, episode
+
+        if parts == ['comics']:
+            if 'title' not in query:
+                return 400, {'error': 'title is required'}
+
+            comics = tables.find_comics(query['title'])
+
+            return 200, {'total': len(comics), 'comics': comics}
+
+        return 404, {'error': f'unknown path {url.path}'}
+
+    def respond(self, target):
+        # (status, encoded body) for a request target, status is never cached
+        self.refresh()
+
+        if urlsplit(target).path.rstrip('/') == '/status':
+            return 200, json.dumps(self.status()).encode()
+
+        return self.get(self.version, target)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # keep-alive, so clients can reuse one connection
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, body = self.server.service.respond(self.path)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(port=None, path=table_store.db_file):
+    if port is None:
+        port = default_port
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), QueryHandler)
+    server.daemon_threads = True
+    server.service = QueryService(path)
+
+    return server
+
+
+def serve(port=None, path=table_store.db_file):
+    server = make_server(port, path)
+
+    print(f'Serving {len(server.service.tables.episodes)} episodes on http://127.0.0.1:{server.server_port}/')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopping.')
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,378 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+# custom scripts
+import instrument
+from records import ComicMention
+
+### global variables ###
+db_file = 'tables/ircb.db'
+episode_file = 'tables/all_episodes.xlsx'
+comic_file = 'tables/public_feed_comics.xlsx'
+# the xlsx tables are exported from db_file on demand. If db_file does not
+# exist yet, it is seeded from them
+
+episode_columns = ['title', 'subtitle', 'has_timestamps', 'date', 'people', 'keywords',
+                   'simplecast_url', 'producer', 'prooflistener', 'editor',
+                   'episode_number', 'full_summary', 'show_id']
+
+comic_columns = list(ComicMention._fields)
+
+regular_overrides = {'Rene': 'René Rodriguez',
+                     'Dave': 'Dave Baker',
+                     'James': 'James', 'Jeff': 'Jeff', 'Jon': 'Jon'}
+# first name -> full name, added to a new regulars registry. Rene Rodriguez
+# is credited without the accent in the feed. The others keep the credits
+# update_tables gave before the registry, when its map came from the
+# curated people column (where Dave Baker is a regular, and James, Jeff
+# and Jon are credited by first name only)
+min_regular_count = 3
+# episodes someone has to be credited on to count as a regular
+
+# seq keeps table order (oldest first), exports are newest first.
+# Curated Patreon episodes have no show_id (until their feed entry is
+# matched, see _reconcile), so show_id is only unique when present
+schema = [
+    f'''CREATE TABLE IF NOT EXISTS episodes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            {', '.join(episode_columns)})''',
+    '''CREATE UNIQUE INDEX IF NOT EXISTS episodes_show_id
+           ON episodes (show_id) WHERE show_id IS NOT NULL''',
+    f'''CREATE TABLE IF NOT EXISTS comics (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            {', '.join(comic_columns)})''',
+    '''CREATE INDEX IF NOT EXISTS comics_show_id ON comics (show_id)''',
+    # regulars registry: credits per name, episodes already counted, manual overrides
+    '''CREATE TABLE IF NOT EXISTS regulars (
+            name TEXT PRIMARY KEY,
+            count INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS regular_episodes (
+            show_id TEXT PRIMARY KEY)''',
+    '''CREATE TABLE IF NOT EXISTS regular_overrides (
+            first_name TEXT PRIMARY KEY,
+            full_name TEXT NOT NULL)''',
+]
+
+
+def connect(path=db_file):
+    seed = not os.path.exists(path)
+
+    con = sqlite3.connect(path)
+
+    for statement in schema:
+        con.execute(statement)
+
+    # first use: start from the curated xlsx tables
+    if seed:
+        import pandas as pd
+
+        try:
+            with con:
+                _upsert_episodes(con, pd.read_excel(episode_file))
+                _insert_comics(con, pd.read_excel(comic_file))
+
+        # don't leave an empty table behind, seed again next time
+        except:
+            con.close()
+            os.remove(path)
+            raise
+
+    return con
+
+
+def _records(df, columns):
+    # rows as tuples, empty cells as NULL, oldest first
+    records = list()
+
+    for row in df[columns].itertuples(index=False):
+        record = list()
+
+        for value in row:
+            if value != value or value == '': # NaN or empty
+                value = None
+            elif isinstance(value, datetime): # incl pd.Timestamp, xlsx date cells
+                value = value.isoformat(sep=' ')
+            elif hasattr(value, 'item'): # numpy scalar
+                value = value.item()
+
+            record.append(value)
+
+        records.append(record)
+
+    return list(reversed(records))
+
+
+def iso_date(value):
+    # ISO date (YYYY-MM-DD) of the table's dates, which come in both RSS and ISO formats
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        pass
+
+    try:
+        return parsedate_to_datetime(value).date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def split_names(value):
+    # names in a comma-separated people / crew cell, without role labels
+    if not isinstance(value, str):
+        return set()
+
+    value = value.replace('Executive Producer:', ',').replace('Producer(s):', ',')
+
+    return set(name.strip() for name in value.split(',') if name.strip())
+
+
+def _title_key(title):
+    # titles compared ignoring case and spacing (some curated titles start with a newline)
+    return ' '.join(str(title).split()).casefold()
+
+
+def _reconcile(con, records):
+    '''
+    Give curated episodes without a show_id the show_id of their feed entry
+
+    The curated Patreon rows have no show_id, so without this their entries
+    from the Patreon feed (show_id = guid) would be added again. A record
+    with a show_id not in the table yet is matched to a row without one on
+    the title, and on the date when the row has one. Only a single match
+    is used. The row keeps its seq and curated values, and gets the
+    show_id and any values it was missing.
+
+    Input: connection, episode records (see _records)
+    Output: the records that matched no row, still to be upserted
+    '''
+
+    unmatched = dict()
+    # title key -> [(seq, ISO date)] of rows without a show_id
+
+    for seq, title, date in con.execute('SELECT seq, title, date FROM episodes WHERE show_id IS NULL AND title IS NOT NULL'):
+        unmatched.setdefault(_title_key(title), list()).append((seq, iso_date(date)))
+
+    if len(unmatched) == 0:
+        return records
+
+    known = set(show_id for show_id, in con.execute('SELECT show_id FROM episodes WHERE show_id IS NOT NULL'))
+
+    show_col = episode_columns.index('show_id')
+    title_col = episode_columns.index('title')
+    date_col = episode_columns.index('date')
+    fills = ', '.join(f'{col} = COALESCE({col}, ?)' for col in episode_columns if col != 'show_id')
+
+    rest = list()
+
+    for record in records:
+        show_id = record[show_col]
+        matches = list()
+
+        if show_id is not None and show_id not in known and record[title_col] is not None:
+            key = _title_key(record[title_col])
+            date = iso_date(record[date_col])
+            matches = [row for row in unmatched.get(key, list()) if row[1] is None or row[1] == date]
+
+        if len(matches) != 1:
+            rest.append(record)
+            continue
+
+        seq, row_date = matches[0]
+        values = [value for col, value in zip(episode_columns, record) if col != 'show_id']
+
+        con.execute(f'UPDATE episodes SET show_id = ?, {fills} WHERE seq = ?', [show_id, *values, seq])
+
+        unmatched[key].remove(matches[0])
+        instrument.count('episodes_reconciled')
+
+    return rest
+
+
+def _upsert_episodes(con, df):
+    # insert new episodes, update existing ones in place (keeps their seq)
+    df = df.copy()
+    df['show_id'] = [None if show_id != show_id else str(show_id) for show_id in df['show_id']]
+
+    cols = ', '.join(episode_columns)
+    marks = ', '.join('?' for col in episode_columns)
+    updates = ', '.join(f'{col} = excluded.{col}' for col in episode_columns if col != 'show_id')
+
+    con.executemany(f'''INSERT INTO episodes ({cols}) VALUES ({marks})
+                        ON CONFLICT (show_id) WHERE show_id IS NOT NULL
+                        DO UPDATE SET {updates}''',
+                    _reconcile(con, _records(df, episode_columns)))
+
+
+def _insert_comics(con, df):
+    df = df.copy()
+    df['show_id'] = [None if show_id != show_id else str(show_id) for show_id in df['show_id']]
+
+    cols = ', '.join(comic_columns)
+    marks = ', '.join('?' for col in comic_columns)
+
+    con.executemany(f'INSERT INTO comics ({cols}) VALUES ({marks})',
+                    _records(df, comic_columns))
+
+
+def upsert(episodes=None, comics=None, path=db_file):
+    '''
+    Add or replace episodes and their comics in one transaction
+
+    Input: dataframes with (at least) episode_columns / comic_columns, newest
+    first. Existing episodes with the same show_id are updated; existing
+    comics for any show_id in comics are replaced.
+    '''
+
+    with instrument.stage('table_write'), closing(connect(path)) as con:
+        with con:
+            if episodes is not None:
+                _upsert_episodes(con, episodes)
+
+            if comics is not None:
+                show_ids = set(str(show_id) for show_id in comics['show_id'])
+
+                con.executemany('DELETE FROM comics WHERE show_id = ?',
+                                [(show_id,) for show_id in show_ids])
+
+                _insert_comics(con, comics)
+
+
+def episode_ids(path=db_file):
+    with closing(connect(path)) as con:
+        rows = con.execute('SELECT show_id FROM episodes WHERE show_id IS NOT NULL').fetchall()
+
+    return set(show_id for show_id, in rows)
+
+
+def count(table, path=db_file):
+    with closing(connect(path)) as con:
+        n, = con.execute(f'SELECT COUNT(*) FROM {table}').fetchone()
+
+    return n
+
+
+def read_episodes(columns=None, path=db_file):
+    # episode table as a dataframe, newest first
+    import pandas as pd
+
+    if columns is None:
+        columns = episode_columns
+
+    with closing(connect(path)) as con:
+        return pd.read_sql_query(f'SELECT {", ".join(columns)} FROM episodes ORDER BY seq DESC', con)
+
+
+def read_comics(columns=None, path=db_file):
+    # comics table as a dataframe, newest first
+    import pandas as pd
+
+    if columns is None:
+        columns = comic_columns
+
+    with closing(connect(path)) as con:
+        return pd.read_sql_query(f'SELECT {", ".join(columns)} FROM comics ORDER BY seq DESC', con)
+
+
+def add_regulars(credits, path=db_file):
+    '''
+    Count credited names of episodes not counted yet
+
+    Input: iterable of (show_id, comma-separated names), eg the feed's authors
+    Output: number of episodes counted
+    '''
+
+    added = 0
+
+    with closing(connect(path)) as con:
+        with con:
+            # new registry: start with the default overrides
+            if con.execute('SELECT 1 FROM regular_episodes LIMIT 1').fetchone() is None:
+                con.executemany('INSERT OR IGNORE INTO regular_overrides VALUES (?, ?)',
+                                list(regular_overrides.items()))
+
+            for show_id, names in credits:
+                cur = con.execute('INSERT OR IGNORE INTO regular_episodes VALUES (?)', (str(show_id),))
+
+                # already counted
+                if cur.rowcount == 0 or not isinstance(names, str):
+                    continue
+
+                for name in names.split(','):
+                    name = name.strip()
+
+                    if name != '':
+                        con.execute('''INSERT INTO regulars VALUES (?, 1)
+                                       ON CONFLICT (name) DO UPDATE SET count = count + 1''',
+                                    (name,))
+
+                added += 1
+
+    return added
+
+
+def read_regulars(path=db_file):
+    '''
+    Show regulars from the registry
+
+    Output: dict of first_name : full_name for everyone credited on at least
+    min_regular_count episodes (the most credited wins a shared first name),
+    with manual overrides on top
+    '''
+
+    with closing(connect(path)) as con:
+        names = con.execute('SELECT name FROM regulars WHERE count >= ? ORDER BY count, name',
+                            (min_regular_count,)).fetchall()
+        overrides = con.execute('SELECT first_name, full_name FROM regular_overrides').fetchall()
+
+    full = dict((name.split()[0], name) for name, in names)
+    full.update(overrides)
+
+    return full
+
+
+def regular_counts(path=db_file):
+    # {name: episodes credited}, most credited first
+    with closing(connect(path)) as con:
+        return dict(con.execute('SELECT name, count FROM regulars ORDER BY count DESC, name'))
+
+
+def set_override(first_name, full_name=None, path=db_file):
+    # map a first name to a full name, or remove the override with full_name=None
+    with closing(connect(path)) as con:
+        with con:
+            if full_name is None:
+                con.execute('DELETE FROM regular_overrides WHERE first_name = ?', (first_name,))
+            else:
+                con.execute('INSERT OR REPLACE INTO regular_overrides VALUES (?, ?)',
+                            (first_name, full_name))
+
+
+def _date_cell(value):
+    # stored date as the xlsx cell it was seeded from: date cells come back
+    # as datetimes, dates from the feed (RSS format) stay text
+    if not isinstance(value, str):
+        return value
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return value
+
+
+def export(path=db_file):
+    # write the xlsx tables
+    with instrument.stage('export'):
+        episodes = read_episodes(path=path)
+        episodes['date'] = [_date_cell(value) for value in episodes['date']]
+        episodes.to_excel(episode_file, index=False)
+
+        comics = read_comics(path=path)
+        comics.to_excel(comic_file, index=False)
+
+    print(f'{len(episodes)} episodes exported to {episode_file}')
+    print(f'{len(comics)} comics exported to {comic_file}')
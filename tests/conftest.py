@@ -0,0 +1,137 @@
+'''
+Shared fixtures: a scratch working directory and a local stand-in for the
+RSS feeds
+'''
+
+import os
+import shutil
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+config_files = ['comic_aliases.json', 'comic_terms.json']
+# read by the parsers from the working directory
+
+# the scripts are flat modules in the repo root
+sys.path.insert(0, repo_dir)
+
+
+def rss(*items):
+    '''
+    RSS document with one item per dict
+
+    Items have guid, title, published (RFC 822) and summary, and optionally
+    content (HTML, becomes content:encoded).
+    '''
+
+    entries = list()
+
+    for item in items:
+        content = ''
+
+        if 'content' in item:
+            content = f'<content:encoded><![CDATA[{item["content"]}]]></content:encoded>'
+
+        entries.append(f'''<item>
+            <guid isPermaLink="false">{item["guid"]}</guid>
+            <title>{item["title"]}</title>
+            <link>https://example.com/episodes/{item["guid"]}</link>
+            <pubDate>{item["published"]}</pubDate>
+            <description><![CDATA[{item["summary"]}]]></description>
+            {content}
+        </item>''')
+
+    return f'''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/">
+<channel>
+    <title>Test feed</title>
+    <link>https://example.com</link>
+    {''.join(entries)}
+</channel>
+</rss>'''.encode('utf-8')
+
+
+class FeedServer:
+    '''
+    Local HTTP server with scripted responses
+
+    route(path, *responses) sets the responses to GET path, one per request
+    in order, the last one repeating. A response is (status, headers, body).
+    Every request is recorded in requests as (path, headers).
+    '''
+
+    def __init__(self):
+        self.routes = dict()
+        self.requests = list()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+
+                responses = server.routes.get(self.path, [(404, dict(), b'')])
+                status, headers, body = responses[0] if len(responses) == 1 else responses.pop(0)
+
+                self.send_response(status)
+
+                for key, value in headers.items():
+                    self.send_header(key, value)
+
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_port}{path}'
+
+    def route(self, path, *responses):
+        self.routes[path] = list(responses)
+
+    def hits(self, path):
+        # headers of every request to path
+        return [headers for p, headers in self.requests if p == path]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def feed_server():
+    server = FeedServer()
+
+    yield server
+
+    server.close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # run in an empty directory, so the stores and feed state are scratch copies
+    for name in config_files:
+        shutil.copy(os.path.join(repo_dir, name), tmp_path / name)
+
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+
+
+@pytest.fixture
+def tables(workdir):
+    # the curated xlsx tables, to seed a scratch table store from
+    shutil.copytree(os.path.join(repo_dir, 'tables'), workdir / 'tables',
+                    ignore=shutil.ignore_patterns('*.db'))
+
+    return workdir / 'tables'
@@ -0,0 +1,155 @@
+import json
+
+import pytest
+
+import episode_store
+import feeds
+from conftest import rss
+
+gmt_item = {'guid': 'bonus-1',
+            'title': 'Book vs. Book 12',
+            'published': 'Wed, 07 Jan 2026 11:00:00 GMT',
+            'summary': '<p>Nick and Jacob pit two books against each other.</p>'
+                       '<p>Timestamps:</p><p>00:00:00 - Intro</p><p>00:02:10 - Saga</p><p>00:31:45 - Monstress</p>'}
+
+public_items = [{'guid': 'ep-2', 'title': 'Second', 'published': 'Wed, 14 Jan 2026 11:00:00 +0000',
+                 'summary': '<p>Second episode.</p>', 'content': '<p>Second episode.</p>'},
+                {'guid': 'ep-1', 'title': 'First', 'published': 'Wed, 07 Jan 2026 11:00:00 +0000',
+                 'summary': '<p>First episode.</p>', 'content': '<p>First episode.</p>'}]
+
+
+@pytest.fixture(autouse=True)
+def no_wait(monkeypatch):
+    # retry right away
+    monkeypatch.setattr(feeds, 'retry_delay', 0)
+
+
+def test_sync_200(workdir, feed_server):
+    feed_server.route('/public', (200, {'ETag': '"v1"'}, rss(*public_items)))
+
+    changed = feeds.sync([{'name': 'public', 'url': feed_server.url('/public')}])
+
+    assert set(changed) == {'ep-1', 'ep-2'}
+    assert list(episode_store.load()) == ['ep-2', 'ep-1']
+    assert feeds.load_state() == {'public': {'etag': '"v1"', 'modified': None}}
+
+
+def test_sync_unchanged_entries(workdir, feed_server):
+    feed_server.route('/public', (200, dict(), rss(*public_items)))
+    feed = [{'name': 'public', 'url': feed_server.url('/public')}]
+
+    feeds.sync(feed)
+
+    # same entries again: nothing new or changed
+    assert feeds.sync(feed) == dict()
+
+
+@pytest.mark.parametrize('validator, header', [('ETag', 'If-None-Match'),
+                                               ('Last-Modified', 'If-Modified-Since')])
+def test_sync_304(workdir, feed_server, validator, header):
+    value = '"v1"' if validator == 'ETag' else 'Wed, 14 Jan 2026 11:00:00 GMT'
+
+    feed_server.route('/public', (200, {validator: value}, rss(*public_items)),
+                      (304, {validator: value}, b''))
+    feed = [{'name': 'public', 'url': feed_server.url('/public')}]
+
+    feeds.sync(feed)
+    changed = feeds.sync(feed)
+
+    first, second = feed_server.hits('/public')
+
+    assert header not in first
+    assert second[header] == value
+    assert changed == dict()
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retry(workdir, feed_server, status):
+    feed_server.route('/public', (status, dict(), b''), (200, dict(), rss(*public_items)))
+
+    changed = feeds.sync([{'name': 'public', 'url': feed_server.url('/public')}])
+
+    assert len(feed_server.hits('/public')) == 2
+    assert set(changed) == {'ep-1', 'ep-2'}
+
+
+def test_retries_exhausted(workdir, feed_server):
+    feed_server.route('/public', (503, dict(), b''))
+
+    changed = feeds.sync([{'name': 'public', 'url': feed_server.url('/public')}])
+
+    assert len(feed_server.hits('/public')) == feeds.retries + 1
+    assert changed == dict()
+    # validators are only saved once a feed is stored
+    assert feeds.load_state() == dict()
+
+
+def test_feed_without_url_skipped(workdir, monkeypatch):
+    monkeypatch.delenv('IRCB_TEST_FEED', raising=False)
+
+    with open('feeds.json', 'w') as fp:
+        fp.write(json.dumps([{'name': 'public', 'url': 'https://example.com/feed'},
+                             {'name': 'patreon', 'url_env': 'IRCB_TEST_FEED'}]))
+
+    assert feeds.load_feeds('feeds.json') == [{'name': 'public', 'url': 'https://example.com/feed'}]
+
+    monkeypatch.setenv('IRCB_TEST_FEED', 'https://example.com/private')
+
+    assert [feed['name'] for feed in feeds.load_feeds('feeds.json')] == ['public', 'patreon']
+
+
+def test_several_feeds_tagged(workdir, feed_server):
+    feed_server.route('/public', (200, dict(), rss(*public_items)))
+    feed_server.route('/patreon', (200, dict(), rss(gmt_item)))
+
+    changed = feeds.sync([{'name': 'public', 'url': feed_server.url('/public')},
+                          {'name': 'patreon', 'url': feed_server.url('/patreon')}])
+
+    assert set(changed) == {'ep-1', 'ep-2', 'bonus-1'}
+
+    stored = episode_store.load()
+
+    assert stored['ep-1']['feed'] == 'public'
+    assert stored['ep-2']['feed'] == 'public'
+    assert stored['bonus-1']['feed'] == 'patreon'
+
+
+def test_summary_only_gmt_entry(workdir, feed_server):
+    import get_comics
+    import get_episodes
+
+    feed_server.route('/patreon', (200, dict(), rss(gmt_item)))
+    feeds.sync([{'name': 'patreon', 'url': feed_server.url('/patreon')}])
+
+    rss_entries = episode_store.load()
+
+    assert 'content' not in rss_entries['bonus-1']
+
+    df = get_episodes.initial_parse(rss_entries)
+
+    assert list(df['show_id']) == ['bonus-1']
+    assert df['full_summary'][0].startswith('Nick and Jacob pit two books')
+    assert df['has_timestamps'][0] == 1
+
+    summary_raw = get_comics.get_summary_raw(rss_entries['bonus-1'])
+    timestamps, bullets = get_comics.extract_html(summary_raw, rss_entries['bonus-1']['links'][0]['href'])
+
+    assert {'Saga', 'Monstress'} <= set(timestamps)
+
+
+def test_summary_only_gmt_entry_comics(workdir, feed_server):
+    import get_comics
+    import ner
+
+    # the full comics parse runs NER
+    pytest.importorskip(ner.model_name)
+
+    feed_server.route('/patreon', (200, dict(), rss(gmt_item)))
+    feeds.sync([{'name': 'patreon', 'url': feed_server.url('/patreon')}])
+
+    rss_entries = episode_store.load()
+    episodes = get_comics.pd.DataFrame({'show_id': ['bonus-1'], 'title': [gmt_item['title']]})
+
+    comics = get_comics.parse_episodes(rss_entries, episodes, workers=1)
+
+    assert {'Saga', 'Monstress'} <= set(comic.comic for comic in comics)
@@ -0,0 +1,27 @@
+import importlib
+
+import pytest
+
+import ner
+
+
+def test_unknown_tier_fails_on_use(monkeypatch):
+    monkeypatch.setenv('IRCB_MODEL_TIER', 'huge')
+
+    # importing still works, so commands without NLP are not affected
+    importlib.reload(ner)
+
+    try:
+        with pytest.raises(ValueError, match='trf, lg, md, sm'):
+            ner.get_nlp()
+    finally:
+        monkeypatch.undo()
+        importlib.reload(ner)
+
+
+def test_set_unknown_tier(monkeypatch):
+    monkeypatch.setattr(ner, 'model_tier', ner.model_tier)
+    monkeypatch.setattr(ner, 'model_name', ner.model_name)
+
+    with pytest.raises(ValueError):
+        ner.set_tier('huge')
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pandas as pd
+
+import episode_html
+import episode_store
+import table_store
+from conftest import repo_dir
+
+
+def test_stream_keeps_curated_rows(tables, monkeypatch):
+    import get_comics
+    import get_episodes
+    import update_tables
+
+    with open(os.path.join(repo_dir, 'public_feed.json'), 'r') as fp:
+        entry = json.loads(fp.read())['0']
+
+    curated = table_store.read_episodes()
+    show_id = episode_store.get_show_id(entry)
+    before = curated[curated['show_id'] == show_id].iloc[0]
+
+    new_entry = dict(entry, id='new-episode')
+    episode_store.upsert([new_entry, entry])
+
+    def extract(episodes, full):
+        episodes = episodes.copy()
+
+        for col in table_store.episode_columns:
+            if col not in episodes:
+                episodes[col] = 'extracted'
+
+        return episodes[table_store.episode_columns]
+
+    monkeypatch.setattr(get_episodes, 'get_regulars', lambda *args, **kwargs: dict())
+    monkeypatch.setattr(get_episodes, 'extract', extract)
+    monkeypatch.setattr(get_comics, 'parse_episodes', lambda rss, episodes, workers=None: list())
+
+    update_tables.stream()
+
+    # nothing held over from the last batch
+    assert episode_html.parse_summary.cache_info().currsize == 0
+
+    after = table_store.read_episodes()
+
+    assert len(after) == len(curated) + 1
+    assert after[after['show_id'] == 'new-episode'].iloc[0]['people'] == 'extracted'
+
+    row = after[after['show_id'] == show_id].iloc[0]
+
+    for col in ['people', 'producer', 'editor', 'prooflistener', 'keywords']:
+        assert row[col] == before[col] or (pd.isna(row[col]) and pd.isna(before[col]))
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+import episode_store
+import feeds
+import get_rss
+from conftest import rss
+
+items = [{'guid': 'ep-1', 'title': 'First', 'published': 'Wed, 07 Jan 2026 11:00:00 +0000',
+          'summary': '<p>First episode.</p>', 'content': '<p>First episode.</p>'}]
+
+
+@pytest.fixture
+def feed_config(workdir, feed_server):
+    # feeds.json with the public feed served locally
+    with open(feeds.feeds_file, 'w') as fp:
+        fp.write(json.dumps([{'name': 'public', 'url': feed_server.url('/public')}]))
+
+
+@pytest.mark.parametrize('state', [{'public': {'etag': '"v7"', 'modified': 'Wed, 14 Jan 2026 11:00:00 GMT'}},
+                                   # single-feed state, from before feeds.json
+                                   {'etag': '"v7"', 'modified': 'Wed, 14 Jan 2026 11:00:00 GMT'}])
+def test_sends_saved_validators(feed_config, feed_server, state):
+    with open(feeds.state_file, 'w') as fp:
+        fp.write(json.dumps(state))
+
+    feed_server.route('/public', (304, dict(), b''))
+
+    get_rss.sync()
+
+    headers, = feed_server.hits('/public')
+
+    assert headers['If-None-Match'] == '"v7"'
+    assert headers['If-Modified-Since'] == 'Wed, 14 Jan 2026 11:00:00 GMT'
+
+
+def test_304_writes_nothing(feed_config, feed_server, monkeypatch):
+    feed_server.route('/public', (200, {'ETag': '"v1"'}, rss(*items)), (304, dict(), b''))
+
+    get_rss.sync()
+
+    with open(feeds.state_file, 'r') as fp:
+        state = fp.read()
+
+    writes = list()
+    monkeypatch.setattr(episode_store, 'upsert', lambda *args, **kwargs: writes.append(args))
+
+    changed = get_rss.sync()
+
+    assert changed == dict()
+    assert writes == list()
+    assert list(episode_store.load()) == ['ep-1']
+
+    with open(feeds.state_file, 'r') as fp:
+        assert fp.read() == state
+
+
+def test_update_skipped_when_nothing_new(feed_config, feed_server, tables, monkeypatch):
+    import get_episodes
+    import table_store
+    import update_tables
+
+    feed_server.route('/public', (304, dict(), b''))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('no update expected')
+
+    monkeypatch.setattr(get_episodes, 'initial_parse', fail)
+    monkeypatch.setattr(table_store, 'upsert', fail)
+    monkeypatch.setattr(table_store, 'export', fail)
+
+    update_tables.main()
+
+    assert len(feed_server.hits('/public')) == 1
+    assert update_tables.update() == 0
+
+
+def test_update_retried_after_failure(feed_config, feed_server, tables, monkeypatch):
+    # stored by a sync whose update failed: added on the next run, though the feed is unchanged
+    import get_episodes
+    import update_tables
+
+    feed_server.route('/public', (200, {'ETag': '"v1"'}, rss(*items)), (304, dict(), b''))
+    get_rss.sync()
+
+    parsed = list()
+
+    def initial_parse(rss_entries):
+        parsed.append(list(rss_entries))
+        raise RuntimeError('stop before NER')
+
+    monkeypatch.setattr(get_episodes, 'initial_parse', initial_parse)
+
+    with pytest.raises(RuntimeError):
+        update_tables.main(export=False)
+
+    assert parsed == [['ep-1']]
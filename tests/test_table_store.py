@@ -0,0 +1,17 @@
+from datetime import datetime
+
+import pandas as pd
+
+import table_store
+
+
+def test_export_keeps_cell_types(tables):
+    before = pd.read_excel(table_store.episode_file)
+
+    table_store.export()
+
+    after = pd.read_excel(table_store.episode_file)
+
+    assert [type(value) for value in after['date']] == [type(value) for value in before['date']]
+    assert datetime(2025, 12, 31, 11, 0) in list(after['date'])
+    assert 'Wed, 11 Feb 2026 11:00:00 +0000' in list(after['date'])
@@ -1,71 +1,183 @@
-import pandas as pd
+from itertools import islice
 
 # custom scripts
+import comic_index
+import episode_html
+import episode_store
 import get_rss
 import get_episodes
 import get_comics
+import instrument
+import search_index
+import table_store
+from records import ComicMention, to_frame
 
 
-### global variables ###
-comic_file = 'tables/public_feed_comics.xlsx'
-episode_file = 'tables/all_episodes.xlsx'
+def main(export=True):
 
-def main():
+	# download new and changed episodes from RSS feed
+	with instrument.stage('sync'):
+		get_rss.sync()
 
-	# load existing data
-	episodes = pd.read_excel(episode_file)
-	comics = pd.read_excel(comic_file)
+	# not just what this sync found: episodes stored by an earlier sync whose
+	# update failed are still missing from the tables, and are added now
+	added = update()
 
-	print(f'Found {len(episodes)} episodes in existing table')
-	print(f'Found {len(comics)} comics in existing table')
+	# regenerate the xlsx tables
+	if export and added > 0:
+		table_store.export()
 
 
-	# download all episodes from RSS feed
-	rss = get_rss.update()
-
-	# parse new rss feed as dataframe
-	df = get_episodes.initial_parse(rss)
-
+def update():
+	# add episodes that are in the episode store but not in the tables yet
+	# returns the number of episodes added
 
 	##### update Episode table
 
-	# identify new episodes
-	new_df = df[~df['show_id'].isin(episodes['show_id'])].copy()
+	# identify new episodes by show_id, only these are loaded and parsed
+	with instrument.stage('store_load'):
+		stored_ids = episode_store.show_ids()
+		new_ids = stored_ids - table_store.episode_ids()
 
-	# full parse for new episodes only
-	new = get_episodes.update(new_df, episodes)
+	instrument.count('episodes_seen', len(stored_ids))
+	instrument.count('episodes_new', len(new_ids))
 
-	updated_episodes = pd.concat([new, episodes])
+	if len(new_ids) == 0:
+		print('No new episodes.')
+		return 0
 
-	# save to file
-	updated_episodes.to_excel(episode_file, index=False)
+	with instrument.stage('store_load'):
+		rss = episode_store.get(new_ids)
 
-	print(f'{len(new)} episodes added to episode table for {len(updated_episodes)} total episodes')
+	# parse new rss entries as dataframe
+	with instrument.stage('initial_parse'):
+		new_df = get_episodes.initial_parse(rss)
 
-	###### update Comics table
+	# full parse for new episodes only, regulars from the registry in table_store
+	with instrument.stage('episodes'):
+		new = get_episodes.update(new_df)
 
-	# episodes we need to get comics from
-	new_rss = dict((i, details) for i, details in rss.items() if int(i) in new.index)
-	rows = get_comics.parse_episodes(new_rss, new_df)
+	###### update Comics table
 
-	# insert 'Timestamps' as segment 
-	# note: rows updated in place
-#	__ = [row.insert(3, 'Timestamps') for row in rows]
+	# episodes we need to get comics from, joined on show_id
+	new_rss = dict((show_id, details) for show_id, details in rss.items() if show_id in set(new['show_id']))
+	with instrument.stage('comics'):
+		rows = get_comics.parse_episodes(new_rss, new_df)
 
 	# convert to dataframe
-	#print(rows[0])
-	#print(comics.columns)
-	new_comics = pd.DataFrame(rows, columns=comics.columns)
+	new_comics = to_frame(rows, ComicMention)
+
+	# save both in one transaction
+	table_store.upsert(episodes=new, comics=new_comics)
 
-	updated_comics = pd.concat([new_comics, comics])
+	# titles seen for the first time become canonical for later episodes
+	with instrument.stage('index_titles'):
+		added = comic_index.add_titles(new_comics['comic'])
 
-	# save to file
-	updated_comics.to_excel(comic_file, index=False)
+	# full-text index of the new episodes and their comics
+	with instrument.stage('search_index'):
+		search_index.add(new['show_id'])
 
-	print(f'{len(new_comics)} comics added to comics table for {len(updated_comics)} total comics')
+	print(f'{len(new)} episodes added to episode table for {table_store.count("episodes")} total episodes')
+	print(f'{len(new_comics)} comics added to comics table for {table_store.count("comics")} total comics')
+	print(f'{added} new comic titles indexed')
 
 	print('Update complete.')
 
+	return len(new)
+
+
+#### streaming mode
+stream_batch_size = 64
+# episodes held in memory at once (with their spacy docs) in stream
+
+
+def batches(entries, size):
+	# {show_id: entry} dicts of up to size entries
+	entries = iter(entries)
+
+	while True:
+		batch = dict(islice(entries, size))
+
+		if len(batch) == 0:
+			return
+
+		yield batch
+
+
+def stream(show_ids=None, batch_size=None):
+	'''
+	Parse episodes into the table store in bounded batches
+
+	Episodes are read from the store oldest first, batch_size at a time.
+	Each batch gets the full parse (people, crew, comics) and is written to
+	the table store before the next one is read, so its spacy docs, rows
+	and parsed summaries are dropped after use and memory does not grow with the number of
+	episodes.
+
+	Episodes already in the tables keep their row, with its curated people
+	and crew: only their comics are parsed again and replaced. Episodes not
+	in the tables yet get the full parse and are added.
+
+	Input: show_ids to parse (None for every stored episode)
+	'''
+
+	if batch_size is None:
+		batch_size = stream_batch_size
+
+	# every stored episode is counted in the registry, so this covers all batches
+	with instrument.stage('regulars'):
+		full = get_episodes.get_regulars()
+
+	# rows that are never overwritten
+	known = table_store.episode_ids()
+
+	n_parsed = 0
+	n_episodes = 0
+	n_comics = 0
+
+	for batch in batches(episode_store.iterate(show_ids, oldest_first=True), batch_size):
+		# newest first within the batch, as in the feed
+		rss = dict(reversed(list(batch.items())))
+
+		with instrument.stage('initial_parse'):
+			new_df = get_episodes.initial_parse(rss)
+
+		# full parse for episodes not in the tables yet
+		new = new_df[~new_df['show_id'].isin(known)].copy()
+
+		if len(new) > 0:
+			with instrument.stage('episodes'):
+				new = get_episodes.extract(new, full)
+
+		with instrument.stage('comics'):
+			rows = get_comics.parse_episodes(rss, new_df)
+
+		new_comics = to_frame(rows, ComicMention)
+
+		table_store.upsert(episodes=new if len(new) > 0 else None, comics=new_comics)
+
+		with instrument.stage('index_titles'):
+			comic_index.add_titles(new_comics['comic'])
+
+		with instrument.stage('search_index'):
+			search_index.add(rss.keys())
+
+		# parsed summaries are only shared within a batch, don't keep them
+		episode_html.parse_summary.cache_clear()
+
+		n_parsed += len(rss)
+		n_episodes += len(new)
+		n_comics += len(new_comics)
+
+		instrument.count('batches')
+		instrument.count('episodes_new', len(new))
+
+		print(f'{n_parsed} episodes parsed: {n_episodes} new episodes and {n_comics} comics written')
+
+	print(f'{n_parsed} episodes streamed to the table store ({n_episodes} new).')
+
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	with instrument.run('update_tables'):
+		main()
@@ -0,0 +1,213 @@
+'''
+Long-running watch mode
+
+Instead of a cron job that starts Python, pandas and the NER model just to
+find that nothing was published, watch keeps one process running:
+
+  1. the model and parsing modules are loaded once, up front
+  2. the feeds are polled (conditional requests, see feeds.py)
+  3. only when the store holds episodes that are not in the tables yet
+     (new ones, or ones left by a failed update) does the update path of
+     update_tables.main run (parse, tables, title index, export)
+  4. it sleeps until the next poll
+
+The wait starts at interval and grows by backoff after every poll that
+adds nothing or fails, up to max_interval, and is reset by a poll that adds
+episodes. A failed update is retried on the next poll, even if the feeds
+have not changed since.
+Every wait is jittered so several watchers do not poll in step.
+
+The state of the watcher (last poll, last change, next poll and the stage
+timings and counters of the last run) is kept in status_file, and served as
+JSON on localhost if a port is given.
+'''
+
+import json
+import os
+import random
+import threading
+import time
+import traceback
+
+# custom scripts
+import instrument
+
+### global variables ###
+interval = 15 * 60
+# seconds between polls while episodes are coming in
+max_interval = 6 * 60 * 60
+# longest wait between polls
+backoff = 1.5
+# wait multiplier after a poll with no changes or a failed poll
+jitter = 0.1
+# each wait is randomly up to this fraction shorter or longer
+
+status_file = 'watch_status.json'
+# last-run status, rewritten after every poll
+_status = dict()
+
+
+def warm():
+    # load everything an update needs once, so polls that find changes do not pay for it
+    import get_comics
+    import get_episodes
+    import ner
+    import update_tables
+
+    ner.get_nlp()
+
+
+def next_delay(delay, changed):
+    '''
+    Seconds to wait before the next poll
+
+    Input: the last wait (before jitter), whether the last poll added episodes
+    Output: (wait, wait with jitter)
+    '''
+
+    if changed:
+        delay = interval
+    else:
+        delay = min(delay * backoff, max_interval)
+
+    return delay, delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def save_status(**kwargs):
+    _status.update(kwargs)
+
+    # written in one go so readers never see half a file
+    tmp = status_file + '.tmp'
+
+    with open(tmp, 'w') as fp:
+        fp.write(json.dumps(_status, indent=2))
+
+    os.replace(tmp, status_file)
+
+
+def serve_status(port):
+    # GET on localhost:port returns the status as JSON, from a daemon thread
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(_status, indent=2).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), StatusHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f'Status served on http://127.0.0.1:{port}/')
+
+    return server
+
+
+def poll(export=True):
+    '''
+    One instrumented run of update_tables.main
+
+    The run report is only saved to report_dir if episodes were added or the
+    run failed, so quiet polls do not fill it up.
+
+    Output: the run report (dict)
+    '''
+
+    import update_tables
+
+    instrument.start('watch')
+    error = None
+
+    try:
+        update_tables.main(export)
+
+    # keep watching, the next poll may succeed
+    except Exception as e:
+        traceback.print_exc()
+        error = repr(e)
+
+    changed = instrument.get_count('episodes_new') > 0
+
+    return instrument.finish(error=error, save=changed or error is not None)
+
+
+def watch(export=True, port=None, polls=None):
+    '''
+    Poll and update until interrupted (or for a given number of polls)
+
+    Input: export the xlsx tables after each update, port to serve the
+    status on (None for the status file only), number of polls (None to
+    run until stopped)
+    '''
+
+    _status.clear()
+    # failures counts failed polls in a row
+    save_status(pid=os.getpid(), started=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                state='warming', polls=0, changes=0, failures=0,
+                last_poll=None, last_change=None, next_poll=None, last_run=None)
+
+    server = None
+
+    if port is not None:
+        server = serve_status(port)
+
+    try:
+        start = time.perf_counter()
+        warm()
+        save_status(warm_seconds=round(time.perf_counter() - start, 3))
+
+        delay = interval
+        n = 0
+
+        while polls is None or n < polls:
+            save_status(state='polling', last_poll=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+            report = poll(export)
+            n += 1
+
+            changed = report['counters'].get('episodes_new', 0) > 0 and report['error'] is None
+            failed = report['error'] is not None or report['counters'].get('feeds_failed', 0) > 0
+
+            delay, wait = next_delay(delay, changed)
+
+            save_status(state='sleeping', polls=n,
+                        changes=_status['changes'] + changed,
+                        failures=_status['failures'] + 1 if failed else 0,
+                        last_change=_status['last_poll'] if changed else _status['last_change'],
+                        next_poll=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() + wait)),
+                        last_run=report)
+
+            if polls is not None and n >= polls:
+                break
+
+            print(f'Next poll in {wait / 60:.1f} minutes')
+            time.sleep(wait)
+
+    except KeyboardInterrupt:
+        print('Stopping.')
+
+    finally:
+        save_status(state='stopped', next_poll=None)
+
+        if server is not None:
+            server.shutdown()
+
+
+def main(export=True, port=None):
+    import signal
+
+    # stop cleanly on kill / systemd stop, as on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    watch(export, port)
+
+
+if __name__ == "__main__":
+    main()